@@ -0,0 +1,131 @@
+"""
+Stage level time and memory benchmarks of SubmissionData and the OLS fit on synthetic
+submissions (clean.synthetic), as a baseline for performance regressions
+
+python benchmark.py --rows 100000 1000000 10000000 --out baseline.csv
+python benchmark.py --rows 100000 1000000 --compare baseline.csv
+"""
+import argparse
+import contextlib
+import io
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+import statsmodels.formula.api as smf
+
+from clean.clean_data import SubmissionData
+from clean.synthetic import synthetic_submissions
+from model.ols import ClusterOLS, TERMS
+import hyperparameter_run
+
+# SubmissionData stages in pipeline order (base_clean, param_clean, finish_clean)
+STAGES = ['datetime_conversions', 'ethnicity_remap', 'aggegate_class_stats_join', 'course_filter',
+          'assignment_filter', 'student_filter', 'validate_n_stud_assign', 'add_ranks', 'group_by_students']
+
+
+def fit_statsmodels(obj):
+    # rows patsy would drop are dropped first, so the cluster groups line up (synthetic demographics have gaps)
+    data = obj.student_course_lvl.dropna(subset=TERMS + ['procrastination_mean_rank'])
+    model = smf.ols(formula=hyperparameter_run.formula, data=data)
+    return model.fit(cov_type='cluster', cov_kwds={'groups': data['course_id']})
+
+
+def fit_cluster_ols(obj):
+    return ClusterOLS(obj.student_course_lvl).fit()
+
+
+FITS = [fit_statsmodels, fit_cluster_ols]
+
+
+def run_pipeline(data, trace=False, compact=False):
+    """
+    runs every stage and fit on a copy of data
+    trace (bool): measure peak python/numpy allocations of each stage with tracemalloc (slower)
+    returns list of (stage, seconds, peak mb or None, rows after the stage)
+    """
+    obj = SubmissionData(columns=list(data.columns), file=None, full_clean=False, data=data.copy(), compact=compact)
+    if compact:
+        obj.compact_dtypes()
+    steps = [(name, getattr(obj, name)) for name in STAGES] + [(fn.__name__, lambda fn=fn: fn(obj)) for fn in FITS]
+
+    records = []
+    for name, step in steps:
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            step()
+        seconds = time.perf_counter() - start
+        peak = None
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+        records.append((name, seconds, peak, len(obj.data)))
+    return records
+
+
+def benchmark(rows, repeat=1, memory=True, compact=False, seed=0):
+    """
+    rows (list): synthetic frame sizes
+    repeat (int): timed runs per size, the fastest is kept
+    memory (bool): one extra traced run per size for peak memory
+    returns df with rows, stage, seconds, peak_mb, frame_mb (input deep size), rows_after
+    """
+    results = []
+    for n_rows in rows:
+        data = synthetic_submissions(n_rows, seed=seed)
+        frame_mb = data.memory_usage(deep=True).sum() / 1e6
+        print('rows: {} (generated {}), frame: {:.1f} mb'.format(n_rows, len(data), frame_mb))
+
+        timed = [run_pipeline(data, compact=compact) for _ in range(repeat)]
+        peaks = [peak for _, _, peak, _ in run_pipeline(data, trace=True, compact=compact)] if memory else None
+        for i, (stage, _, _, rows_after) in enumerate(timed[0]):
+            results.append({
+                'rows': n_rows,
+                'stage': stage,
+                'seconds': min(run[i][1] for run in timed),
+                'peak_mb': peaks[i] if memory else None,
+                'frame_mb': frame_mb,
+                'rows_after': rows_after,
+            })
+            print('  {:<28}{:>10.3f} s{}'.format(
+                stage, results[-1]['seconds'], '' if not memory else '{:>10.1f} mb peak'.format(peaks[i])))
+    return pd.DataFrame(results)
+
+
+def compare(results, baseline, tolerance=1.25):
+    """
+    returns rows of results slower (or with a higher peak) than baseline by more than tolerance
+    """
+    merged = results.merge(baseline, on=['rows', 'stage'], suffixes=('', '_baseline'))
+    merged['time_ratio'] = merged['seconds'] / merged['seconds_baseline']
+    merged['memory_ratio'] = merged['peak_mb'] / merged['peak_mb_baseline']
+    slower = (merged['time_ratio'] > tolerance) | (merged['memory_ratio'] > tolerance)
+    return merged.loc[slower, ['rows', 'stage', 'seconds', 'seconds_baseline', 'time_ratio',
+                               'peak_mb', 'peak_mb_baseline', 'memory_ratio']]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10 ** 5, 10 ** 6, 10 ** 7])
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs per size, fastest kept')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced run for peak memory')
+    parser.add_argument('--compact', action='store_true', help='compact dtypes (see SubmissionData)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='csv to write the results to')
+    parser.add_argument('--compare', help='baseline csv from an earlier --out')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='allowed slowdown ratio against the baseline')
+    args = parser.parse_args()
+
+    results = benchmark(args.rows, args.repeat, not args.no_memory, args.compact, args.seed)
+    if args.out:
+        results.to_csv(args.out, index=False)
+    if args.compare:
+        regressions = compare(results, pd.read_csv(args.compare), args.tolerance)
+        if len(regressions):
+            print('regressions against {}:'.format(args.compare))
+            print(regressions.to_string(index=False))
+            sys.exit(1)
+        print('no regressions against {}'.format(args.compare))
@@ -0,0 +1,155 @@
+"""
+DuckDB execution of the SubmissionData pipeline: the class stats join, course, assignment and
+student filters, the a_n/s_n invariants, ranks and the student-course aggregation run as one
+query plan (multi-threaded, group statistics fused by the optimizer) over the key columns.
+
+Only row positions and computed columns come back; the surviving rows of the pandas frame are
+taken by position, so data and student_course_lvl are the frames the pandas stages produce
+(same columns, order, index and dtypes).
+"""
+import numpy as np
+import pandas as pd
+
+from db.queries import filter_ctes, invariant_condition
+
+BACKENDS = ['pandas', 'duckdb']
+KEY_COLUMNS = ['course_id', 'user_id', 'assignment_id', 'final_score', 'submitted_at']
+RANK_STAT_COLUMNS = ['mean rank', 'procrastination_mean_rank', 'procrastination_median_rank',
+                     'procrastination_var_rank', 'procrastination_std_rank']
+# columns the pandas stages add to data, in order (filtered exports already carry the first three)
+STAGE_COLUMNS = ['course_size', 'course_mean', 'n_assignments', 'n_assignments_updated', 'n_students_updated',
+                 'assignment_ranks', 'assignment_percentile_ranks'] + RANK_STAT_COLUMNS
+STUDENT_DROP_COLUMNS = ['submitted_at', 'due_date', 'assignment_id', 'assignment_ranks', 'assignment_percentile_ranks']
+
+
+def pipeline_query(a_n=5, s_n=20, a_thres=0.5, s_thres=0.5, filtered=False, table='submissions'):
+    """
+    returns select over table (KEY_COLUMNS and _row, the row position) with the surviving rows'
+    _row, the columns the stages compute, first_row (the row group_by_students keeps) and the
+    final score ranks of first rows (unordered, run_duckdb sorts by _row)
+    filtered (bool): table comes from db.queries.filtered_submissions_query and already has
+                     course_size, course_mean and n_assignments (filters are not run again; as in
+                     add_ranks, rows with a missing user are then ranked within their assignment
+                     without student statistics, and rows with a missing assignment are left unranked)
+
+    The filters and invariants are db.queries.filter_ctes and invariant_condition, the ones
+    filtered_submissions_query exports with; ranks are averaged over ties, missing times are
+    left unranked.
+    """
+    computed = (["course_size", "course_mean", "n_assignments"] if not filtered else []) + STAGE_COLUMNS[3:]
+    return """
+WITH base AS (
+  SELECT * FROM {table}
+),{filters},
+validated AS (
+  -- validate_n_stud_assign
+  SELECT s3.*, ci.n_assignments_updated, ci.n_students_updated
+  FROM s3
+  INNER JOIN course_invariants ci ON ci.course_id = s3.course_id
+  WHERE {invariants}
+),
+time_counts AS (
+  SELECT assignment_id, submitted_at, COUNT(*) AS n_tied
+  FROM validated
+  WHERE assignment_id IS NOT NULL AND submitted_at IS NOT NULL
+  GROUP BY assignment_id, submitted_at
+),
+time_ranks AS (
+  -- add_ranks: average rank of tied submission times (rows before the time + mean position among ties),
+  -- as rank(method='average'), from one sort of the distinct times instead of windows over every row
+  SELECT assignment_id, submitted_at,
+         SUM(n_tied) OVER (PARTITION BY assignment_id ORDER BY submitted_at) - n_tied + (n_tied + 1) / 2.0
+           AS assignment_ranks,
+         SUM(n_tied) OVER (PARTITION BY assignment_id) AS n_ranked
+  FROM time_counts
+),
+ranked AS (
+  SELECT v.*, tr.assignment_ranks, tr.assignment_ranks / tr.n_ranked AS assignment_percentile_ranks
+  FROM validated v
+  LEFT JOIN time_ranks tr ON tr.assignment_id = v.assignment_id AND tr.submitted_at = v.submitted_at
+),
+student_stats AS (
+  SELECT user_id, course_id,
+         MIN(_row) AS first_row,
+         AVG(assignment_ranks) AS "mean rank",
+         AVG(assignment_percentile_ranks) AS procrastination_mean_rank,
+         MEDIAN(assignment_percentile_ranks) AS procrastination_median_rank,
+         VAR_SAMP(assignment_percentile_ranks) AS procrastination_var_rank,
+         STDDEV_SAMP(assignment_percentile_ranks) AS procrastination_std_rank
+  FROM ranked
+  WHERE user_id IS NOT NULL
+  GROUP BY user_id, course_id
+),
+final_scores AS (
+  -- group_by_students: final score ranks among the students (first rows) of a course
+  SELECT v._row,
+         CASE WHEN v.final_score IS NULL THEN NULL
+              ELSE RANK() OVER (PARTITION BY v.course_id ORDER BY v.final_score)
+                   + (COUNT(*) OVER (PARTITION BY v.course_id, v.final_score) - 1) / 2.0
+         END AS final_score_ranks,
+         COUNT(v.final_score) OVER (PARTITION BY v.course_id) AS n_scores
+  FROM student_stats ss
+  INNER JOIN validated v ON v._row = ss.first_row
+)
+SELECT r._row, {computed}, fs._row IS NOT NULL AS first_row,
+       fs.final_score_ranks,
+       fs.final_score_ranks / fs.n_scores AS final_score_percentile_ranks
+FROM ranked r
+LEFT JOIN student_stats ss ON ss.user_id = r.user_id AND ss.course_id = r.course_id
+LEFT JOIN final_scores fs ON fs._row = r._row
+""".format(
+        table=table,
+        filters=filter_ctes(a_thres, s_thres, filtered),
+        invariants=invariant_condition(a_n, s_n),
+        computed=", ".join(
+            'ss."{}"'.format(col) if col in RANK_STAT_COLUMNS else 'r."{}"'.format(col) for col in computed
+        ),
+    )
+
+
+def run_duckdb(obj, filtered=False, threads=None):
+    """
+    runs the pipeline stages of obj (SubmissionData, after datetime_conversions and ethnicity_remap)
+    in duckdb, setting obj.data and obj.student_course_lvl as the pandas stages would
+    threads (int): duckdb worker threads, default all cores
+    """
+    import duckdb  # only needed for backend='duckdb'
+
+    data = obj.data
+    keys = data[KEY_COLUMNS].reset_index(drop=True)
+    keys.insert(0, '_row', np.arange(len(keys), dtype=np.int64))
+    con = duckdb.connect()
+    try:
+        if threads is not None:
+            con.execute('PRAGMA threads={}'.format(int(threads)))
+        con.register('submissions', keys)
+        query = pipeline_query(obj.a_n, obj.s_n, obj.a_thres, obj.s_thres, filtered=filtered)
+        result = con.execute(query).fetchnumpy()
+    finally:
+        con.close()
+
+    # surviving rows by position, then the computed columns in stage order
+    order = np.argsort(result['_row'], kind='stable')
+    result = {col: _values(values[order]) for col, values in result.items()}
+    out = data.take(result['_row'])
+    out.index = pd.RangeIndex(len(out))
+    for col in STAGE_COLUMNS:
+        if col in result:
+            out[col] = result[col]
+    if 'course_size' in result and data['course_id'].isna().any():
+        # the pandas merge leaves courseless rows a nan course_size, so the column is float
+        out['course_size'] = out['course_size'].astype(float)
+    obj.data = out
+
+    first = result['first_row']
+    student = out[first].copy()
+    student['final_score_ranks'] = result['final_score_ranks'][first]
+    student['final_score_percentile_ranks'] = result['final_score_percentile_ranks'][first]
+    obj.student_course_lvl = student.drop(STUDENT_DROP_COLUMNS, axis=1)
+
+
+def _values(values):
+    # nulls come back masked: nan for the float columns (the integer ones have no nulls)
+    if values.dtype.kind == 'f' or np.ma.is_masked(values):
+        return np.ma.filled(values.astype(float), np.nan)
+    return np.asarray(values)
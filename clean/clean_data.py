@@ -1,98 +1,164 @@
 import pandas as pd
 import pandas.api.types as ptypes
-import sys
-import math 
+import numpy as np
+
+from clean.backend import BACKENDS, run_duckdb
+from clean.ingest import read_submissions
+from clean.instrument import GroupCounts, Instrumentation
+from db.queries import FILTER_COLUMNS
+
+# compact mode dtypes
+CATEGORY_COLUMNS = ['course_name', 'ethnicity', 'gender', 'is_a_urm', 'first_gen_status']
+ID_COLUMNS = ['course_id', 'user_id', 'assignment_id']
+RANK_COLUMNS = ['assignment_ranks', 'assignment_percentile_ranks', 'mean rank', 'procrastination_mean_rank',
+                'procrastination_median_rank', 'procrastination_var_rank', 'procrastination_std_rank',
+                'final_score_ranks', 'final_score_percentile_ranks']
 
 
 class SubmissionData:
-    def __init__(self, columns, file, a_n=5, s_n=20, a_thres=0.5, s_thres=0.5, full_clean=True):
+    def __init__(self, columns, file, a_n=5, s_n=20, a_thres=0.5, s_thres=0.5, full_clean=True, data=None, cache_dir=None,
+                 compact=False, filtered=False, instrument=None, backend='pandas'):
         """
         a_n (int > 0): assignment number invariant
         s_n (int > 0): student number invariant 
         a_thres (float): assignment filter threshold [0..1]
         s_thress (float): student filter threshold [0..1]
+        data (df): optional pre-loaded submission data, used instead of reading file
+        cache_dir (str): optional directory for a parquet cache of file (see clean.ingest)
+        compact (bool): category/narrow numeric dtypes, and deep memory usage recorded after each stage
+        filtered (bool): file was exported with db.queries.filtered_submissions_query for this
+                         configuration, so the course, assignment and student filters already ran
+        instrument (Instrumentation): receives an event per stage (time, rows, group counts, memory);
+                                      default prints them with incrementally maintained group counts
+        backend (str): 'pandas', or 'duckdb' to run the full_clean stages after ethnicity_remap as one
+                       multi-threaded query (see clean.backend); data and student_course_lvl are the
+                       same frames, the stage methods themselves always run in pandas
         """
+        if backend not in BACKENDS:
+            raise ValueError('backend must be one of {}, got {!r}'.format(BACKENDS, backend))
         self.a_n, self.s_n = a_n, s_n
         self.a_thres, self.s_thres = a_thres, s_thres
-
-        self.data = pd.read_csv(file, usecols=columns, low_memory=False)
-        print("size of df: {} mb".format(sys.getsizeof(self.data) / 1e6))
-        self.student_course_lvl = None 
+        self.compact = compact
+        self.backend = backend
+        self.instrument = Instrumentation() if instrument is None else instrument
+        self._groups = None  # GroupCounts of data, built on first use
+        self.data, self.student_course_lvl = None, None
+
+        if data is None:
+            if filtered:
+                columns = list(columns) + FILTER_COLUMNS
+            with self.instrument.stage(self, 'read_submissions'):
+                self.data = read_submissions(file, columns, cache_dir, categorical=compact)
+                if compact:
+                    self.compact_dtypes()
+        else:
+            self.data = data
 
         if full_clean:
-            og = self.data.groupby(['course_id', 'user_id']).ngroups
-            og_c = self.data.groupby(['course_id']).ngroups
-            print('og student course obs: {}'.format(og))
-            print('og course obs: {}'.format(og_c))
-            self.datetime_conversions()
-            self.ethnicity_remap()
+            self.instrument.observe(self, 'og')
+            if backend == 'duckdb':
+                self._run_stages([self.datetime_conversions, self.ethnicity_remap])
+                with self.instrument.stage(self, 'duckdb_pipeline'):
+                    assert ptypes.is_datetime64_any_dtype(self.data["submitted_at"])
+                    run_duckdb(self, filtered)
+                    if self.compact:
+                        self._compact_ranks(self.data)
+                        self._compact_student_course_lvl()
+            elif filtered:
+                self._run_stages([self.datetime_conversions, self.ethnicity_remap])
+                self.finish_clean()
+            else:
+                self.base_clean()
+                self.param_clean()
+
+    def base_clean(self):
+        """
+        stages that do not depend on a_n, s_n, a_thres or s_thres
+        """
+        self._run_stages([self.datetime_conversions, self.ethnicity_remap,
+                          self.aggegate_class_stats_join, self.course_filter])
+
+    def param_clean(self):
+        """
+        stages that depend on a_n, s_n, a_thres or s_thres (run after base_clean)
+        """
+        self._run_stages([self.assignment_filter, self.student_filter])
+        self.finish_clean()
 
-            self.aggegate_class_stats_join()
-            self.course_filter()
-            self.assignment_filter()
-            self.student_filter()
-            
-            self.validate_n_stud_assign()
-            self.add_ranks()
-            self.group_by_students()
+    def finish_clean(self):
+        """
+        invariants, ranks and student-course aggregation (run after the assignment and student filters)
+        """
+        self._run_stages([self.validate_n_stud_assign, self.add_ranks, self.group_by_students])
 
-            self.student_course_lvl.dropna() # pd.rank ignores nan values --> sets them to nan
+        self.student_course_lvl.dropna() # pd.rank ignores nan values --> sets them to nan
 
+    def _run_stages(self, stages):
+        for stage in stages:
+            with self.instrument.stage(self, stage.__name__):
+                stage()
 
+    def group_counts(self, report=False):
+        """
+        returns dict with the number of student-course groups and courses in data
+        report (bool): also the number excluded since the last report (see GroupCounts)
+        the groups are computed once, filters update them from the rows they drop
+        """
+        if self._groups is None or len(self._groups) != len(self.data):
+            self._groups = GroupCounts(self.data)
+        return self._groups.report() if report else self._groups.counts()
+
+    def memory_usage(self):
+        """
+        returns deep memory usage of data (mb), including string contents
+        """
+        return self.data.memory_usage(deep=True).sum() / 1e6
+
+    def compact_dtypes(self):
+        """
+        category dtype for demographic/name columns, narrowest integer dtype for ids
+        ids with missing values stay float
+        """
+        for col in CATEGORY_COLUMNS:
+            if col in self.data.columns:
+                self.data[col] = self.data[col].astype('category')
+        for col in ID_COLUMNS:
+            if col in self.data.columns:
+                self.data[col] = pd.to_numeric(self.data[col], downcast='integer')
+
+    def _compact_ranks(self, data):
+        for col in RANK_COLUMNS:
+            if col in data.columns:
+                data[col] = data[col].astype(np.float32)
+
+    def _keep_rows(self, mask, keys):
+        """
+        mask (bool series): row-level result of a group-level predicate
+        keys (list): group columns; rows with a missing key are dropped, as groupby().filter does
+        """
+        keep = mask & self.data[keys].notna().all(axis=1)
+        positions = np.flatnonzero(keep.values)
+        if self._groups is not None and len(self._groups) == len(self.data):
+            self._groups.keep(positions)
+        self.data = self.data.take(positions)  # take: new frame, not a view of the old one
 
     def assignment_filter(self):
-        total = self.data.groupby(['course_id', 'user_id']).ngroups
-        total_c = self.data.groupby(['course_id']).ngroups
-        print('assignment filter student_course obs (prior): {}'.format(total))
-        print('assignment filter course obs (prior): {}'.format(total_c))
-        assignment_filter = lambda df: (df['user_id'].nunique() / df.head(1)["course_size"].values[0]) > self.a_thres
-        
-        self.data = self.data.groupby("assignment_id").filter(assignment_filter)
-
-        excluded = self.data.groupby(['course_id', 'user_id']).ngroups
-        excluded_c = self.data.groupby(['course_id']).ngroups
-        
-        print('assignment filter student-course obs (after): {}, num excluded: {}'.format(excluded, total-excluded))
-        print('assignment filter course obs (after): {}, num excluded: {}'.format(excluded_c, total_c - excluded_c))
+        # share of the course's students submitting each assignment, broadcast back to rows
+        n_submitters = self.data.groupby("assignment_id")["user_id"].transform("nunique")
+        course_size = self.data.groupby("assignment_id")["course_size"].transform("first")
+        self._keep_rows((n_submitters / course_size) > self.a_thres, ["assignment_id"])
 
     def course_filter(self):
-        total = self.data.groupby(['course_id', 'user_id']).ngroups
-        total_c = self.data.groupby(['course_id']).ngroups
-        print('course filter student_course obs (prior): {}'.format(total))
-        print('course filter course obs (prior): {}'.format(total_c))
-        course_filter = (
-            lambda df: df.head(1)["course_mean"].values[0] != 0
-        )  # course_mean constant with course groupby
-        self.data = self.data.groupby("course_id").filter(course_filter)
-        
-        excluded = self.data.groupby(['course_id', 'user_id']).ngroups
-        excluded_c = self.data.groupby(['course_id']).ngroups
-        print('course filter student-course obs (after): {}, num excluded: {}'.format(excluded, total-excluded))
-        print('course filter course obs (after): {}, num excluded: {}'.format(excluded_c, total_c - excluded_c))
+        # course_mean constant with course groupby
+        self._keep_rows(self.data["course_mean"] != 0, ["course_id"])
 
     def student_filter(self):
-        total = self.data.groupby(['course_id', 'user_id']).ngroups
-        total_c = self.data.groupby(['course_id']).ngroups
-        print('student filter student_course obs (prior): {}'.format(total))
-        print('student filter course obs (prior): {}'.format(total_c))
-        n_assignments = self.data.groupby("course_id")["assignment_id"].nunique()
-        self.data = self.data.merge(n_assignments, on=["course_id"], how="left")
-        self.data = self.data.rename(
-            columns={
-                "assignment_id_x": "assignment_id",
-                "assignment_id_y": "n_assignments",
-            }
-        )
-        student_filter = (
-            lambda df: df["assignment_id"].nunique() > math.floor(df["n_assignments"].head(1) * self.s_thres)
+        self.data["n_assignments"] = self.data.groupby("course_id")["assignment_id"].transform("nunique")
+        n_submitted = self.data.groupby(["user_id", "course_id"])["assignment_id"].transform("nunique")
+        self._keep_rows(
+            n_submitted > np.floor(self.data["n_assignments"] * self.s_thres), ["user_id", "course_id"]
         )
 
-        self.data = self.data.groupby(["user_id", "course_id"]).filter(student_filter)
-        excluded = self.data.groupby(['course_id', 'user_id']).ngroups
-        excluded_c = self.data.groupby(['course_id']).ngroups
-        print('student filter student-course obs (after): {}, num excluded: {}'.format(excluded, total-excluded))
-        print('student filter course obs (after): {}, num excluded: {}'.format(excluded_c, total_c - excluded_c))
-
 
     def datetime_conversions(self):
         self.data["submitted_at"] = pd.to_datetime(self.data["submitted_at"])
@@ -109,102 +175,62 @@ class SubmissionData:
         self.data = self.data.rename(
             columns={"user_id_x": "user_id", "user_id_y": "course_size"}
         )
-        print("class size joined")
         self.data = self.data.merge(course_means, on="course_id", how="left")
         self.data = self.data.rename(
             columns={"final_score_x": "final_score", "final_score_y": "course_mean"}
         )
-        print("class mean joined")
 
     def add_ranks(self):
         # Submissions Ranks
         assert ptypes.is_datetime64_any_dtype(self.data["submitted_at"])
 
-        self.data["assignment_ranks"] = self.data.groupby("assignment_id")[
-            "submitted_at"
-        ].rank(
-            method="average"
-        )  # take average rank to break ties
-        self.data["assignment_percentile_ranks"] = self.data.groupby("assignment_id")[
-            "submitted_at"
-        ].rank(method="average", pct=True)
-        print("ranks added")
-        # mean assignment ranks (student, course level)
-        mean_ranks = self.data.groupby(["user_id", "course_id"])[
-            "assignment_ranks"
-        ].mean()
-        median_percentile_ranks = self.data.groupby(["user_id", "course_id"])[
-            "assignment_percentile_ranks"
-        ].median()
-        var_percentile_ranks = self.data.groupby(["user_id", "course_id"])[
-            "assignment_percentile_ranks"
-        ].var()
-        std_percentile_ranks = self.data.groupby(["user_id", "course_id"])[
-            "assignment_percentile_ranks"
-        ].std()
-        mean_percentile_ranks = self.data.groupby(["user_id", "course_id"])[
-            "assignment_percentile_ranks"
-        ].mean()
-        print("mean ranks computed")
-        # rank merge
-        self.data = self.data.merge(mean_ranks, on=["user_id", "course_id"], how="left")
-
-        self.data = self.data.rename(
-            columns={
-                "assignment_ranks_x": "assignment_ranks",
-                "assignment_ranks_y": "mean rank",
+        # dropna=False: with missing keys, grouped ranks of datetimes rank NaT as the earliest time
+        # (pandas >= 2.0); rows without an assignment are left unranked instead
+        by_assignment = self.data.groupby("assignment_id", dropna=False)["submitted_at"]
+        # take average rank to break ties
+        self.data["assignment_ranks"] = by_assignment.rank(method="average").where(self.data["assignment_id"].notna())
+        # same as rank(pct=True): average rank over non-null submissions in the assignment
+        self.data["assignment_percentile_ranks"] = self.data["assignment_ranks"] / by_assignment.transform("count")
+        # rank statistics (student, course level), one grouped pass
+        by_student = self.data.groupby(["user_id", "course_id"])
+        stats = by_student.agg(
+            **{
+                "mean rank": ("assignment_ranks", "mean"),
+                "procrastination_mean_rank": ("assignment_percentile_ranks", "mean"),
+                "procrastination_median_rank": ("assignment_percentile_ranks", "median"),
+                "procrastination_var_rank": ("assignment_percentile_ranks", "var"),
+                "procrastination_std_rank": ("assignment_percentile_ranks", "std"),
             }
         )
+        # broadcast to submissions by group number; rows without a group (-1) pick the appended nan
+        # (ngroup() of a row with a missing key is -1 or nan depending on the pandas version)
+        codes = by_student.ngroup().fillna(-1).astype(np.int64).values
+        for col in stats.columns:
+            self.data[col] = np.append(stats[col].values, np.nan)[codes]
+        self.data.index = pd.RangeIndex(len(self.data))  # index of the merge this replaces
 
-        self.data = self.data.merge(
-            mean_percentile_ranks, on=["user_id", "course_id"], how="left"
-        )
-
-        self.data = self.data.rename(
-            columns={
-                "assignment_percentile_ranks_x": "assignment_percentile_ranks",
-                "assignment_percentile_ranks_y": "procrastination_mean_rank",
-            }
-        )
-
-        self.data = self.data.merge(
-            median_percentile_ranks, on=["user_id", "course_id"], how="left"
-        )
-        self.data = self.data.rename(
-            columns={
-                "assignment_percentile_ranks_x": "assignment_percentile_ranks",
-                "assignment_percentile_ranks_y": "procrastination_median_rank",
-            }
-        )
-
-        self.data = self.data.merge(
-            var_percentile_ranks, on=["user_id", "course_id"], how="left"
-        )
-        self.data = self.data.rename(
-            columns={
-                "assignment_percentile_ranks_x": "assignment_percentile_ranks",
-                "assignment_percentile_ranks_y": "procrastination_var_rank",
-            }
-        )
-
-        self.data = self.data.merge(
-            std_percentile_ranks, on=["user_id", "course_id"], how="left"
-        )
-        self.data = self.data.rename(
-            columns={
-                "assignment_percentile_ranks_x": "assignment_percentile_ranks",
-                "assignment_percentile_ranks_y": "procrastination_std_rank",
-            }
-        )
-
-        print("mean ranks merged")
+        if self.compact:
+            self._compact_ranks(self.data)
 
     def ethnicity_remap(self):
-      self.data['ethnicity'] = self.data['ethnicity'].replace('Non Resident Alien', 'International')
-      self.data['ethnicity'] = self.data['ethnicity'].replace('Two or More Races', 'Multiple Races')
-      self.data['ethnicity'] = self.data['ethnicity'].replace('Hawaii/Pac', 'Native/Pacific')
-      self.data['ethnicity'] = self.data['ethnicity'].replace('Am. Indian', 'Native/Pacific')
-      self.data['ethnicity'] = self.data['ethnicity'].replace('No Citizenship Status', 'Unknown')
+      remap = {
+          'Non Resident Alien': 'International',
+          'Two or More Races': 'Multiple Races',
+          'Hawaii/Pac': 'Native/Pacific',
+          'Am. Indian': 'Native/Pacific',
+          'No Citizenship Status': 'Unknown',
+      }
+      ethnicity = self.data['ethnicity']
+      if isinstance(ethnicity.dtype, pd.CategoricalDtype):
+        # rename categories, merging the ones that map to the same name
+        names = ethnicity.cat.categories.to_series().replace(remap)
+        categories = pd.Index(names.unique()).sort_values()
+        new_codes = categories.get_indexer(names)
+        codes = ethnicity.cat.codes.values
+        self.data['ethnicity'] = pd.Categorical.from_codes(np.where(codes >= 0, new_codes[codes], -1), categories)
+      else:
+        for old, new in remap.items():
+          self.data['ethnicity'] = self.data['ethnicity'].replace(old, new)
 
     def group_by_students(self):
       # keep only unique course_id, user_id (student level)
@@ -214,35 +240,27 @@ class SubmissionData:
       # final grade ranks
       self.student_course_lvl['final_score_ranks'] = self.student_course_lvl.groupby('course_id')['final_score'].rank(method='average')
       self.student_course_lvl['final_score_percentile_ranks'] = self.student_course_lvl.groupby('course_id')['final_score'].rank(method='average', pct=True)
-      print('final score ranks added')
 
       # drop unnecessary submission-related columns (non-aggregate columns)
       self.student_course_lvl = self.student_course_lvl.drop(['submitted_at', 'due_date', 'assignment_id',
                                           'assignment_ranks', 'assignment_percentile_ranks'], axis=1)
-      print('dropped submission/assignment related columns')
 
-      print('df rows (student-course level):{}'.format(len(self.student_course_lvl)))
+      if self.compact:
+        self._compact_student_course_lvl()
 
-    def validate_n_stud_assign(self):
-        print('validating student and assignment count invariants')
-        print('submissions observations after all filter methods: {}'.format(len(self.data)))
-        stud_data = self.data.groupby("course_id")["user_id"].nunique()
-        assign_data = self.data.groupby("course_id")["assignment_id"].nunique()
-        
-        self.data = self.data.merge(assign_data, on=["course_id"], how="left")
-        self.data = self.data.rename(
-            columns={
-                "assignment_id_x": "assignment_id",
-                "assignment_id_y": "n_assignments_updated",
-            }
-        )
-        self.data = self.data.merge(stud_data, on=["course_id"], how="left")
-        self.data = self.data.rename(columns={"user_id_x": "user_id", "user_id_y": "n_students_updated"})
+    def _compact_student_course_lvl(self):
+      self._compact_ranks(self.student_course_lvl)
+      # filtered out groups would otherwise show up as empty levels in C(...) and groupbys
+      for col in self.student_course_lvl.select_dtypes('category').columns:
+        self.student_course_lvl[col] = self.student_course_lvl[col].cat.remove_unused_categories()
 
-        student_invariant = lambda df: df.head(1)["n_students_updated"].values[0] > self.s_n
-        assignment_invariant = lambda df: df.head(1)["n_assignments_updated"].values[0] > self.a_n
+    def validate_n_stud_assign(self):
+        # n_assignments_updated/n_students_updated constant with course groupby
+        self.data["n_assignments_updated"] = self.data.groupby("course_id")["assignment_id"].transform("nunique")
+        self.data["n_students_updated"] = self.data.groupby("course_id")["user_id"].transform("nunique")
 
-        self.data = self.data.groupby(['course_id']).filter(student_invariant)
-        self.data = self.data.groupby(['course_id']).filter(assignment_invariant)
+        self._keep_rows(
+            (self.data["n_students_updated"] > self.s_n) & (self.data["n_assignments_updated"] > self.a_n),
+            ["course_id"],
+        )
 
-        print('final submissions obs (maintaining invariants): {}'.format(len(self.data)))
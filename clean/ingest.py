@@ -0,0 +1,177 @@
+import hashlib
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DATETIME_COLUMNS = ["submitted_at", "due_date"]
+
+
+def cache_path(file, columns, cache_dir):
+    """
+    parquet path for file in cache_dir, keyed by the file's size, mtime and the requested columns
+    """
+    stat = os.stat(file)
+    key = "{}|{}|{}|{}".format(
+        os.path.abspath(file), stat.st_size, stat.st_mtime_ns, ",".join(sorted(columns or []))
+    )
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(file))[0]
+    return os.path.join(cache_dir, "{}-{}.parquet".format(stem, digest))
+
+
+def read_submissions(file, columns, cache_dir=None, categorical=False):
+    """
+    reads submission csv, through a parquet cache when cache_dir is given
+    file (str): path to submission level csv
+    columns (list): columns to read
+    cache_dir (str): directory for the columnar cache (created if missing)
+    categorical (bool): keep cached string columns as category dtype
+    returns df with the csv's dtypes, except DATETIME_COLUMNS already parsed
+    file can also be a local extract directory (see write_extract), which is read directly
+    """
+    if os.path.isdir(file):
+        return read_extract(file, columns)
+    if cache_dir is None:
+        return pd.read_csv(file, usecols=columns, low_memory=False)
+
+    path = cache_path(file, columns, cache_dir)
+    if not os.path.exists(path):
+        write_cache(file, columns, path)
+        print("ingest cache written: {}".format(path))
+    else:
+        print("ingest cache hit: {}".format(path))
+
+    data = pq.read_table(path, memory_map=True).to_pandas()
+    if categorical:
+        return data
+    # strings are stored dictionary encoded, give back the csv dtype
+    for col in data.columns:
+        if isinstance(data[col].dtype, pd.CategoricalDtype):
+            data[col] = data[col].astype(data[col].cat.categories.dtype)
+    return data
+
+
+def write_cache(file, columns, path):
+    """
+    parses csv once and writes it to path as parquet: timestamps parsed, strings dictionary encoded
+    """
+    data = pd.read_csv(file, usecols=columns, low_memory=False)
+    for col in data.columns:
+        if col in DATETIME_COLUMNS:
+            data[col] = pd.to_datetime(data[col])
+        elif data[col].dtype == object or pd.api.types.is_string_dtype(data[col]):
+            data[col] = data[col].astype("category")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # write then rename, so an interrupted run never leaves a partial cache behind
+    tmp = path + ".tmp"
+    pq.write_table(pa.Table.from_pandas(data, preserve_index=False), tmp)
+    os.replace(tmp, path)
+
+
+# local extract: directory with base.parquet plus delta parts from incremental refreshes
+# (delta-#####.parquet rows and delta-#####.changed.parquet superseded submission ids),
+# merged on read by submission_id
+EXTRACT_BASE = "base.parquet"
+
+
+def write_extract(directory, batches, schema=None):
+    """
+    writes arrow record batches (e.g. Client.query_batches) or a table as the extract's base,
+    replacing earlier deltas
+    schema (pa.Schema): schema of an empty result, default batches.schema (a RecordBatchReader's)
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, EXTRACT_BASE)
+    tmp = path + ".tmp"
+    if isinstance(batches, pa.Table):
+        pq.write_table(batches, tmp)
+    else:
+        writer = None
+        for batch in batches:
+            if writer is None:
+                writer = pq.ParquetWriter(tmp, batch.schema)
+            writer.write_table(pa.Table.from_batches([batch]))
+        if writer is None:
+            # no batches: an empty base with the result's columns
+            schema = getattr(batches, "schema", None) if schema is None else schema
+            if schema is None:
+                raise ValueError("no record batches and no schema to write an empty extract with")
+            writer = pq.ParquetWriter(tmp, schema)
+        writer.close()
+    os.replace(tmp, path)
+
+    for name in _delta_names(directory):
+        os.remove(os.path.join(directory, name + ".parquet"))
+        os.remove(os.path.join(directory, name + ".changed.parquet"))
+
+
+def write_extract_delta(directory, delta, changed_ids):
+    """
+    adds a refresh to the extract without rewriting it
+    delta (df): new versions of submissions (with submission_id)
+    changed_ids (list): submission ids whose earlier rows are superseded (includes delta's)
+    returns name of the delta part, None if nothing changed
+    """
+    if len(changed_ids) == 0:
+        return None
+    names = _delta_names(directory)
+    name = "delta-{:05d}".format(int(names[-1].split("-")[1]) + 1 if names else 1)
+    # changed ids first: a part is only read once its rows file exists
+    pq.write_table(
+        pa.table({"submission_id": pa.array(changed_ids, type=pa.int64())}),
+        os.path.join(directory, name + ".changed.parquet"),
+    )
+    tmp = os.path.join(directory, name + ".parquet.tmp")
+    pq.write_table(pa.Table.from_pandas(delta, preserve_index=False), tmp)
+    os.replace(tmp, os.path.join(directory, name + ".parquet"))
+    return name
+
+
+def read_extract(directory, columns=None):
+    """
+    reads the extract's base and deltas, keeping for each submission_id only the rows of the
+    latest part that changed it
+    """
+    read_columns = None if columns is None else list(dict.fromkeys(list(columns) + ["submission_id"]))
+    names = [EXTRACT_BASE[: -len(".parquet")]] + _delta_names(directory)
+    frames, changed = [], []
+    for part, name in enumerate(names):
+        frame = pq.read_table(os.path.join(directory, name + ".parquet"), columns=read_columns, memory_map=True)
+        frame = frame.to_pandas()
+        frame["_part"] = part
+        frames.append(frame)
+        if part > 0:
+            ids = pq.read_table(os.path.join(directory, name + ".changed.parquet")).to_pandas()
+            ids["_part"] = part
+            changed.append(ids)
+
+    data = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    if changed:
+        last_changed = pd.concat(changed).groupby("submission_id")["_part"].max()
+        superseded = data["submission_id"].map(last_changed).fillna(-1).values
+        data = data[data["_part"].values >= superseded].reset_index(drop=True)
+    data = data.drop(columns=["_part"])
+    if columns is not None and "submission_id" not in columns:
+        data = data.drop(columns=["submission_id"])
+    return data
+
+
+def compact_extract(directory):
+    """
+    rewrites base with all deltas applied and removes them
+    """
+    merged = read_extract(directory)
+    write_extract(directory, pa.Table.from_pandas(merged, preserve_index=False))
+
+
+def _delta_names(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        name[: -len(".parquet")]
+        for name in os.listdir(directory)
+        if name.startswith("delta-") and name.endswith(".parquet") and not name.endswith(".changed.parquet")
+    )
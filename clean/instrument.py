@@ -0,0 +1,163 @@
+"""
+Per-stage events of the SubmissionData pipeline: wall time, rows, group counts and memory
+"""
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+
+class GroupCounts:
+    """
+    Student-course and course counts of a frame, kept up to date as rows are dropped.
+    Group codes are computed once; a filter only subtracts its dropped rows from the
+    per-group row counts instead of regrouping the frame.
+    """
+    def __init__(self, data=None, codes=None):
+        """
+        data (df): frame with course_id and user_id, grouped once
+        codes (dict): group codes per row instead of data (see subset)
+        """
+        if codes is None:
+            codes = {
+                'student_courses': _group_codes(data, ['course_id', 'user_id']),
+                'courses': _group_codes(data, ['course_id']),
+            }
+        self.codes = codes
+        # rows with a missing key have code -1 and no group, as in groupby().ngroups
+        self.sizes = {name: np.bincount(codes[codes >= 0]) for name, codes in self.codes.items()}
+        self.reported = self.counts()
+
+    def __len__(self):
+        return len(self.codes['courses'])
+
+    def keep(self, positions):
+        """
+        positions (array): rows kept by a filter, positions into the frame the counts describe
+        """
+        for name, codes in self.codes.items():
+            dropped = np.delete(codes, positions)
+            self.sizes[name] -= np.bincount(dropped[dropped >= 0], minlength=len(self.sizes[name]))
+            self.codes[name] = codes[positions]
+
+    def subset(self, positions):
+        """
+        returns GroupCounts of the rows at positions, without regrouping
+        """
+        return GroupCounts(codes={name: codes[positions] for name, codes in self.codes.items()})
+
+    def counts(self):
+        return {name: int(np.count_nonzero(sizes)) for name, sizes in self.sizes.items()}
+
+    def report(self):
+        """
+        returns counts and the number of groups excluded since the last report
+        """
+        counts = self.counts()
+        report = dict(counts)
+        for name, n in counts.items():
+            report[name + '_excluded'] = self.reported[name] - n
+        self.reported = counts
+        return report
+
+
+def _group_codes(data, keys):
+    # ngroup() of rows with a missing key is -1 or nan depending on the pandas version
+    codes = data.groupby(keys).ngroup().values
+    return np.where(np.isnan(codes), -1, codes).astype(np.int64) if codes.dtype.kind == 'f' else codes
+
+
+class Instrumentation:
+    """
+    Records an event (dict) per SubmissionData stage in events, optionally printed and
+    appended to a json lines file. One instance can be shared by many SubmissionData
+    objects (e.g. a SubmissionSweep); events carry the configuration they came from.
+    """
+    def __init__(self, counts=True, memory=False, verbose=True, path=None):
+        """
+        counts (bool): student-course and course counts after every stage (see GroupCounts)
+        memory (bool): peak traced allocations of every stage (tracemalloc, slows the stages down)
+                       and deep size of the frame after it
+        verbose (bool): print a line per event
+        path (str): json lines file events are appended to
+        """
+        self.counts, self.memory = counts, memory
+        self.verbose, self.path = verbose, path
+        self.events = []
+
+    @contextmanager
+    def stage(self, obj, name):
+        """
+        times the body as stage name of obj (SubmissionData) and records its event
+        """
+        rows_before = None if obj.data is None else len(obj.data)
+        tracing = self.memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1] / 1e6
+                if tracing:
+                    tracemalloc.stop()
+        self.observe(obj, name, seconds=seconds, rows_before=rows_before, peak_mb=peak)
+
+    def observe(self, obj, name, **fields):
+        """
+        records the current state of obj as an event
+        """
+        event = {
+            'stage': name,
+            'a_n': obj.a_n, 's_n': obj.s_n, 'a_thres': obj.a_thres, 's_thres': obj.s_thres,
+            'seconds': None, 'rows_before': None,
+            'rows': len(obj.data),
+        }
+        event.update(fields)
+        if self.counts:
+            event.update(obj.group_counts(report=True))
+        if obj.student_course_lvl is not None:
+            event['student_course_rows'] = len(obj.student_course_lvl)
+        if self.memory or obj.compact:
+            event['frame_mb'] = obj.memory_usage()
+        self.record(event)
+
+    def record(self, event):
+        self.events.append(event)
+        if self.verbose:
+            print(self.format(event))
+        if self.path is not None:
+            with open(self.path, 'a') as fh:
+                fh.write(json.dumps(event, default=str) + '\n')
+
+    def format(self, event):
+        """
+        one line summary of an event
+        """
+        parts = [event['stage']]
+        if event['seconds'] is not None:
+            parts.append('{:.3f} s'.format(event['seconds']))
+        if event['rows_before'] is not None and event['rows_before'] != event['rows']:
+            parts.append('obs: {}, num excluded: {}'.format(event['rows'], event['rows_before'] - event['rows']))
+        else:
+            parts.append('obs: {}'.format(event['rows']))
+        for name, label in [('student_courses', 'student-course obs'), ('courses', 'course obs')]:
+            if name in event:
+                excluded = event[name + '_excluded']
+                parts.append('{}: {}'.format(label, event[name]) + (', num excluded: {}'.format(excluded) if excluded else ''))
+        if 'student_course_rows' in event:
+            parts.append('df rows (student-course level): {}'.format(event['student_course_rows']))
+        if event.get('peak_mb') is not None:
+            parts.append('peak: {:.1f} mb'.format(event['peak_mb']))
+        if 'frame_mb' in event:
+            parts.append('size of df: {:.1f} mb'.format(event['frame_mb']))
+        return ' | '.join(parts)
+
+    def to_frame(self):
+        return pd.DataFrame(self.events)
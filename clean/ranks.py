@@ -0,0 +1,257 @@
+"""
+Incremental submission-time ranks: the assignment ranks and (user, course) rank statistics of
+SubmissionData.add_ranks, kept up to date as batches of new or changed submissions arrive
+"""
+import numpy as np
+import pandas as pd
+
+KEY_COLUMNS = ['user_id', 'course_id', 'assignment_id']
+STAT_COLUMNS = ['mean rank', 'procrastination_mean_rank', 'procrastination_median_rank',
+                'procrastination_var_rank', 'procrastination_std_rank']
+
+
+class RankIndex:
+    """
+    Keeps a sorted array of submission times per assignment and the (user, course) rank
+    statistics. An update re-ranks only the assignments it touches and recomputes the
+    statistics of the students with a submission in them (a new submission shifts every rank
+    of its assignment) from their current ranks, so nothing accumulates over a stream of
+    updates; the results match add_ranks on the updated frame.
+
+    index = RankIndex(data)
+    index.update(new_submissions)  # returns the affected students' statistics
+    index.to_frame()  # submissions with the columns add_ranks adds
+    """
+    def __init__(self, data):
+        """
+        data (df): submissions with user_id, course_id, assignment_id and datetime submitted_at,
+                   one row per (user_id, course_id, assignment_id)
+        """
+        self.levels = {col: pd.Index([]) for col in KEY_COLUMNS}
+        self.codes = {col: np.empty(0, dtype=np.int64) for col in KEY_COLUMNS}
+        self.times = np.empty(0, dtype=np.int64)
+        self.assignment_ranks = np.empty(0)
+        self.percentile_ranks = np.empty(0)
+
+        # submission keys (student, assignment), sorted, with their row positions
+        self._students = pd.Index([], dtype=np.int64)  # user code << 32 | course code, by student code
+        self._student_codes = np.empty(0, dtype=np.int64)
+        self._keys = np.empty(0, dtype=np.int64)
+        self._key_rows = np.empty(0, dtype=np.int64)
+
+        self._sorted = {}  # assignment code -> sorted submission times (ns), missing times left out
+        self._values = np.empty((len(STAT_COLUMNS), 0))  # per student STAT_COLUMNS
+        self.update(data)
+
+    def __len__(self):
+        return len(self.times)
+
+    def update(self, batch):
+        """
+        batch (df): new submissions, or new submitted_at of known (user_id, course_id, assignment_id)
+        returns statistics of the students whose ranks changed, indexed by (user_id, course_id)
+        """
+        codes = {col: self._encode(col, batch[col]) for col in KEY_COLUMNS}
+        times = _nanoseconds(batch['submitted_at'])
+        students = self._encode_students(codes['user_id'], codes['course_id'])
+        keys = np.where((students >= 0) & (codes['assignment_id'] >= 0),
+                        (students << 32) | codes['assignment_id'], -1)
+        sorted_keys = np.sort(keys[keys >= 0])
+        if (sorted_keys[1:] == sorted_keys[:-1]).any():
+            raise ValueError('batch has more than one row per (user_id, course_id, assignment_id)')
+
+        # known submissions are changed in place, the others appended
+        known = np.zeros(len(keys), dtype=bool)
+        changed = np.empty(0, dtype=np.int64)
+        if len(self._keys):
+            found = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+            known = (keys >= 0) & (self._keys[found] == keys)
+            changed = self._key_rows[found[known]]
+        old_times = self.times[changed]
+        self.times[changed] = times[known]
+
+        start = len(self.times)
+        new = ~known
+        for col in KEY_COLUMNS:
+            self.codes[col] = np.concatenate([self.codes[col], codes[col][new]])
+        self.times = np.concatenate([self.times, times[new]])
+        self._student_codes = np.concatenate([self._student_codes, students[new]])
+        self.assignment_ranks = np.concatenate([self.assignment_ranks, np.full(np.count_nonzero(new), np.nan)])
+        self.percentile_ranks = np.concatenate([self.percentile_ranks, np.full(np.count_nonzero(new), np.nan)])
+        added = np.arange(start, len(self.times))
+        self._add_keys(keys[new], added)
+
+        # sorted times: drop the old times of changed submissions, merge in the new ones
+        assignments = self.codes['assignment_id']
+        touched_rows = np.concatenate([changed, added])
+        affected = _present(assignments[touched_rows], len(self.levels['assignment_id']))
+        removed = _runs(assignments[changed], old_times, affected)
+        inserted = _runs(assignments[touched_rows], self.times[touched_rows], affected)
+        for a, removed_times, inserted_times in zip(affected, removed, inserted):
+            values = self._sorted.get(a, np.empty(0, dtype=np.int64))
+            self._sorted[a] = _insert(_remove(values, removed_times), inserted_times)
+
+        # re-rank every submission of the affected assignments
+        positions = np.flatnonzero(_member(assignments, affected, len(self.levels['assignment_id'])))
+        positions = positions[np.argsort(assignments[positions], kind='stable')]
+        bounds = np.searchsorted(assignments[positions], np.append(affected, np.iinfo(np.int64).max))
+        for i, a in enumerate(affected):
+            block = positions[bounds[i]:bounds[i + 1]]
+            values = self._sorted[a]
+            t = self.times[block]
+            valid = t != _NAT
+            # average rank of tied times: mean of the first and last position of the value
+            ranks = (np.searchsorted(values, t, 'left') + np.searchsorted(values, t, 'right') + 1) / 2
+            self.assignment_ranks[block] = np.where(valid, ranks, np.nan)
+            self.percentile_ranks[block] = np.where(valid, ranks / len(values), np.nan)
+
+        # statistics of the students with a re-ranked submission, from all their submissions
+        touched = _present(self._student_codes[positions], len(self._students))
+        self._grow(len(self._students))
+        rows = np.flatnonzero(_member(self._student_codes, touched, len(self._students)))
+        self._recompute(touched, rows)
+        return self._stats(touched)
+
+    def student_stats(self):
+        """
+        returns rank statistics of every student, as the by_student.agg of add_ranks
+        """
+        return self._stats(np.arange(len(self._students)))
+
+    def to_frame(self):
+        """
+        returns submissions (key columns, submitted_at) with the columns add_ranks adds,
+        in the order they were first seen
+        """
+        frame = pd.DataFrame({col: self._decode(col, self.codes[col]) for col in KEY_COLUMNS})
+        frame['submitted_at'] = self.times.view('datetime64[ns]')  # _NAT is NaT
+        frame['assignment_ranks'] = self.assignment_ranks
+        frame['assignment_percentile_ranks'] = self.percentile_ranks
+        stats = self._stat_arrays(np.arange(len(self._students)))
+        for col in STAT_COLUMNS:
+            # rows without a student (missing key) pick the appended nan
+            frame[col] = np.append(stats[col], np.nan)[self._student_codes]
+        return frame
+
+    def _stats(self, students):
+        pairs = self._students.values[students]
+        index = pd.MultiIndex.from_arrays(
+            [self._decode('user_id', pairs >> 32), self._decode('course_id', pairs & 0xFFFFFFFF)],
+            names=['user_id', 'course_id'])
+        return pd.DataFrame(self._stat_arrays(students), index=index).sort_index()
+
+    def _stat_arrays(self, students):
+        return dict(zip(STAT_COLUMNS, self._values[:, students]))
+
+    def _recompute(self, students, rows):
+        """
+        sets the statistics of students (sorted codes) from their submissions (rows): means and a
+        two-pass variance over the ranked ones, as the by_student.agg of add_ranks
+        """
+        codes, ranks, pct = self._student_codes[rows], self.assignment_ranks[rows], self.percentile_ranks[rows]
+        valid = ~np.isnan(ranks)
+        codes, ranks, pct = codes[valid], ranks[valid], pct[valid]
+        n = len(self._students)
+        count = np.bincount(codes, minlength=n)[students]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_rank = np.bincount(codes, weights=ranks, minlength=n)[students] / count
+            mean = np.bincount(codes, weights=pct, minlength=n) / np.bincount(codes, minlength=n)
+            squares = np.bincount(codes, weights=(pct - mean[codes]) ** 2, minlength=n)[students]
+            var = np.where(count > 1, squares / (count - 1), np.nan)
+        medians = pd.Series(pct).groupby(codes).median().reindex(students).values
+        self._values[:, students] = [mean_rank, mean[students], medians, var, np.sqrt(var)]
+
+    def _encode(self, col, values):
+        """
+        codes of values in levels[col], unseen values appended to it, -1 for missing values
+        """
+        codes = self.levels[col].get_indexer(values)
+        unseen = (codes < 0) & values.notna().values
+        if unseen.any():
+            new = pd.Index(pd.unique(values[unseen]))
+            self.levels[col] = self.levels[col].append(new) if len(self.levels[col]) else new
+            codes = self.levels[col].get_indexer(values)
+        return codes.astype(np.int64)
+
+    def _decode(self, col, codes):
+        levels = self.levels[col]
+        if not len(levels):
+            return np.full(len(codes), np.nan)
+        values = levels.take(np.maximum(codes, 0))
+        return values.where(codes >= 0) if (codes < 0).any() else values
+
+    def _encode_students(self, user_codes, course_codes):
+        pairs = np.where((user_codes >= 0) & (course_codes >= 0), (user_codes << 32) | course_codes, -1)
+        codes = self._students.get_indexer(pairs)
+        unseen = (codes < 0) & (pairs >= 0)
+        if unseen.any():
+            self._students = self._students.append(pd.Index(pd.unique(pairs[unseen])))
+            codes = self._students.get_indexer(pairs)
+        return np.where(pairs >= 0, codes, -1).astype(np.int64)
+
+    def _add_keys(self, keys, rows):
+        valid = keys >= 0
+        keys, rows = keys[valid], rows[valid]
+        order = np.argsort(keys)
+        at = np.searchsorted(self._keys, keys[order])
+        self._keys = np.insert(self._keys, at, keys[order])
+        self._key_rows = np.insert(self._key_rows, at, rows[order])
+
+    def _grow(self, n_students):
+        extra = n_students - self._values.shape[1]
+        if extra > 0:
+            self._values = np.concatenate([self._values, np.full((len(STAT_COLUMNS), extra), np.nan)], axis=1)
+
+
+_NAT = np.iinfo(np.int64).min  # missing submitted_at as nanoseconds
+
+
+def _nanoseconds(times):
+    return np.asarray(pd.to_datetime(times).values.astype('datetime64[ns]').view(np.int64))
+
+
+def _present(codes, n):
+    """
+    returns the sorted distinct codes in [0, n) (codes are bounded, no hashing needed)
+    """
+    return np.flatnonzero(np.bincount(codes[codes >= 0], minlength=n))
+
+
+def _member(codes, groups, n):
+    """
+    returns codes in groups, as np.isin, by a lookup table over [0, n)
+    """
+    table = np.zeros(n + 1, dtype=bool)  # the extra last entry is looked up by code -1
+    table[groups] = True
+    return table[codes]
+
+
+def _runs(codes, times, groups):
+    """
+    returns the sorted non missing times of each of groups (sorted codes)
+    """
+    order = np.lexsort((times, codes))
+    codes, times = codes[order], times[order]
+    lefts = np.searchsorted(codes, groups, 'left')
+    rights = np.searchsorted(codes, groups, 'right')
+    return [times[left:right][times[left:right] != _NAT] for left, right in zip(lefts, rights)]
+
+
+def _remove(values, removed):
+    """
+    values (sorted array) without one occurrence of each of removed (sorted, all present)
+    """
+    if not len(removed):
+        return values
+    # equal removed values take consecutive positions of their run in values
+    first = np.searchsorted(removed, removed, 'left')
+    return np.delete(values, np.searchsorted(values, removed, 'left') + np.arange(len(removed)) - first)
+
+
+def _insert(values, inserted):
+    """
+    values (sorted array) merged with inserted (sorted)
+    """
+    if not len(values):
+        return inserted
+    return np.insert(values, np.searchsorted(values, inserted), inserted)
@@ -0,0 +1,224 @@
+import hashlib
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from clean.clean_data import SubmissionData
+from clean.instrument import GroupCounts, Instrumentation
+
+
+class SubmissionSweep:
+    """
+    Loads and pre-cleans submission data once, then derives a SubmissionData per
+    hyperparameter configuration.
+
+    Surviving rows are cached per stage as positions into the pre-cleaned base frame:
+    assignment_filter per a_thres, student_filter per (a_thres, s_thres). Only the
+    invariants, ranks and student-course aggregation run for every configuration.
+    """
+    def __init__(self, columns, file, base=None, cache_dir=None, compact=False, instrument=None):
+        """
+        columns (list): columns to read from file
+        file (str): path to submission level csv
+        base (df): optional frame that already went through base_clean (file is not read)
+        cache_dir (str): optional directory for a parquet cache of file (see clean.ingest)
+        compact (bool): compact dtypes (see SubmissionData)
+        instrument (Instrumentation): shared by every SubmissionData of the sweep
+        """
+        self.columns, self.file = columns, file
+        self.compact = compact
+        self.instrument = Instrumentation() if instrument is None else instrument
+        self._groups = None  # GroupCounts of base, derived frames take subsets of it
+        if base is None:
+            base = SubmissionData(columns=columns, file=file, full_clean=False, cache_dir=cache_dir, compact=compact,
+                                  instrument=self.instrument)
+            self.instrument.observe(base, 'og')
+            base.base_clean()
+            self._groups = base._groups
+            base = base.data
+        # index labels == positions, so filtered frames' index maps back into base
+        # (a frame attached in a worker already has them; reset_index would copy its shared columns)
+        self.base = base if base.index.equals(pd.RangeIndex(len(base))) else base.reset_index(drop=True)
+
+        self._assignment_rows = {}  # a_thres -> positions
+        self._student_rows = {}  # (a_thres, s_thres) -> (positions, n_assignments)
+        self._courses = {}  # (a_thres, s_thres) -> per course n_students, n_assignments, digest
+
+    def _derive(self, data, **params):
+        obj = SubmissionData(
+            columns=self.columns, file=self.file, full_clean=False, data=data, compact=self.compact,
+            instrument=self.instrument, **params
+        )
+        if self.instrument.counts:
+            if self._groups is None:
+                self._groups = GroupCounts(self.base)
+            obj._groups = self._groups.subset(data.index.values)
+        return obj
+
+    def _assignment_filtered(self, a_thres):
+        if a_thres not in self._assignment_rows:
+            obj = self._derive(self.base, a_thres=a_thres)
+            obj._run_stages([obj.assignment_filter])
+            self._assignment_rows[a_thres] = obj.data.index.values
+        return self.base.take(self._assignment_rows[a_thres])
+
+    def _student_filtered(self, a_thres, s_thres):
+        key = (a_thres, s_thres)
+        if key not in self._student_rows:
+            obj = self._derive(self._assignment_filtered(a_thres), a_thres=a_thres, s_thres=s_thres)
+            obj._run_stages([obj.student_filter])
+            self._student_rows[key] = (obj.data.index.values, obj.data['n_assignments'].values)
+
+        rows, n_assignments = self._student_rows[key]
+        data = self.base.take(rows)
+        # n_assignments is counted before the student filter, so it cannot be recomputed here
+        data['n_assignments'] = n_assignments
+        return data
+
+    def _course_digests(self, a_thres, s_thres):
+        key = (a_thres, s_thres)
+        if key not in self._courses:
+            # every column: a regrade or a new submission time changes the digest as much as a new row
+            data = self._student_filtered(a_thres, s_thres)
+            # counts of validate_n_stud_assign, and a digest of each course's rows (sorted row hashes)
+            courses = data.groupby('course_id').agg(
+                n_students=('user_id', 'nunique'), n_assignments=('assignment_id', 'nunique')
+            )
+            hashes = pd.util.hash_pandas_object(data, index=False).values
+            codes = courses.index.get_indexer(data['course_id'])
+            order = np.lexsort((hashes, codes))
+            hashes, bounds = hashes[order], np.searchsorted(codes[order], np.arange(len(courses) + 1))
+            courses['digest'] = [
+                hashlib.sha1(hashes[bounds[i]:bounds[i + 1]].tobytes()).hexdigest() for i in range(len(courses))
+            ]
+            self._courses[key] = courses
+        return self._courses[key]
+
+    def fingerprint(self, a_n=5, s_n=20, a_thres=0.5, s_thres=0.5):
+        """
+        returns digest of the rows (every column) surviving the configuration's filters and
+        invariants; configurations with the same digest build the same SubmissionData (and fits),
+        also across runs over refreshed data. The invariants keep whole courses, so it is computed
+        from per course counts and digests of the student filtered rows, cached per (a_thres, s_thres),
+        without running them
+        """
+        courses = self._course_digests(a_thres, s_thres)
+        keep = (courses['n_students'] > s_n) & (courses['n_assignments'] > a_n)
+        return hashlib.sha1(''.join(courses['digest'][keep]).encode()).hexdigest()
+
+    def build(self, a_n=5, s_n=20, a_thres=0.5, s_thres=0.5):
+        """
+        returns fully cleaned SubmissionData for the configuration, equal to
+        SubmissionData(columns, file, a_n, s_n, a_thres, s_thres, full_clean=True)
+        """
+        data = self._student_filtered(a_thres, s_thres)
+        obj = self._derive(data, a_n=a_n, s_n=s_n, a_thres=a_thres, s_thres=s_thres)
+        obj.finish_clean()
+        return obj
+
+    def map(self, fn, configs, workers=1):
+        """
+        yields fn(self.build(*config)) for every (a_n, s_n, a_thres, s_thres) in configs, in order
+        fn (function): module level function of a SubmissionData, result must be picklable if workers > 1
+        workers (int): number of processes; base frame is shared with them as memory-mapped columns
+        """
+        if workers <= 1:
+            for config in configs:
+                yield fn(self.build(*config))
+            return
+
+        with tempfile.TemporaryDirectory() as directory:
+            handle = _share_frame(self.base, directory)
+            with multiprocessing.Pool(
+                workers, initializer=_init_worker,
+                initargs=(handle, self.columns, self.file, self.compact, self.instrument, fn),
+            ) as pool:
+                # imap keeps results in configs order
+                for res in pool.imap(_run_config, configs):
+                    yield res
+
+
+def _share_frame(data, directory):
+    """
+    writes every column of data to a .npy file in directory
+    strings (and other non-numpy columns) are stored as categorical codes
+    returns handle (list) for _attach_frame
+    """
+    handle = []
+    for i, col in enumerate(data.columns):
+        series = data[col]
+        tz, categories = None, None
+        if isinstance(series.dtype, pd.DatetimeTZDtype):
+            tz = series.dt.tz
+            values = series.dt.tz_convert(None).to_numpy()
+        elif isinstance(series.dtype, np.dtype) and series.dtype.kind in "biufcmM":
+            values = series.to_numpy()
+        else:
+            categorical = pd.Categorical(series)
+            values, categories = categorical.codes, categorical.categories
+
+        path = os.path.join(directory, "{}.npy".format(i))
+        np.save(path, values)
+        handle.append((col, series.dtype, path, tz, categories))
+    return handle
+
+
+def _attach_frame(handle):
+    """
+    rebuilds the frame written by _share_frame around the memory-mapped columns, without copying
+    them: strings stay categorical over the shared codes and tz-aware times naive utc (pandas 2.0
+    copies them into a tz-aware array), see _restore_dtypes
+    returns (frame, {column: dtype} of the columns to restore)
+    """
+    columns, restore = {}, {}
+    for col, dtype, path, tz, categories in handle:
+        # copy-on-write map: pages are shared between processes until written
+        values = np.load(path, mmap_mode="c")
+        if tz is not None:
+            restore[col] = dtype
+        elif categories is not None:
+            categorical = isinstance(dtype, pd.CategoricalDtype)
+            values = pd.Categorical.from_codes(values, dtype=dtype if categorical else pd.CategoricalDtype(categories))
+            if not categorical:
+                restore[col] = dtype
+        columns[col] = pd.Series(values, copy=False)
+    # copy=False: one block per column (no consolidation into copies), pandas >= 2.0 also
+    # takes rows without consolidating the frame in place
+    return pd.DataFrame(columns, copy=False), restore
+
+
+def _restore_dtypes(obj, dtypes):
+    """
+    casts the stand-ins of _attach_frame back in a built SubmissionData's frames, so workers
+    return what a serial build does (only the configuration's rows are converted)
+    """
+    _restore_frame(obj.data, dtypes)
+    _restore_frame(obj.student_course_lvl, dtypes)
+    return obj
+
+
+def _restore_frame(frame, dtypes):
+    for col, dtype in dtypes.items():
+        if col not in frame.columns:
+            continue
+        if isinstance(dtype, pd.DatetimeTZDtype):
+            frame[col] = frame[col].dt.tz_localize("UTC").dt.tz_convert(dtype.tz)
+        else:
+            frame[col] = frame[col].astype(dtype)
+
+
+_worker = {}
+
+
+def _init_worker(handle, columns, file, compact, instrument, fn):
+    # workers record into their own copy of instrument (printed / appended to its path)
+    base, _worker["dtypes"] = _attach_frame(handle)
+    _worker["sweep"] = SubmissionSweep(columns, file, base=base, compact=compact, instrument=instrument)
+    _worker["fn"] = fn
+
+
+def _run_config(config):
+    return _worker["fn"](_restore_dtypes(_worker["sweep"].build(*config), _worker["dtypes"]))
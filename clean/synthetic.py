@@ -0,0 +1,101 @@
+"""
+Synthetic Canvas-like submission data with the columns hyperparameter_run.py loads, for
+benchmarks and checks without the production database
+"""
+import numpy as np
+import pandas as pd
+
+ETHNICITIES = ['White', 'Asian', 'Hispanic', 'Black', 'Two or More Races', 'Non Resident Alien',
+               'Unknown', 'Am. Indian', 'Hawaii/Pac', 'No Citizenship Status']
+ETHNICITY_WEIGHTS = [0.42, 0.2, 0.14, 0.07, 0.05, 0.05, 0.04, 0.01, 0.01, 0.01]
+
+# fraction of missing values per column
+MISSING = {'final_score': 0.02, 'ethnicity': 0.01, 'gender': 0.01, 'is_a_urm': 0.01, 'first_gen_status': 0.02}
+
+
+def synthetic_submissions(n_rows=100000, n_courses=None, enrollment=60, assignments=20, submit_rate=(0.6, 1.0),
+                          courses_per_student=3, zero_score_courses=0.05, missing=MISSING, seed=0):
+    """
+    returns submission level df (one row per submitted assignment), about n_rows rows
+    n_courses (int): number of courses, by default derived from n_rows
+    enrollment (float): mean students per course (lognormal, heavy tailed like real course sizes)
+    assignments (float): mean assignments per course (poisson)
+    submit_rate (tuple): range of the per-assignment share of enrolled students who submit
+    courses_per_student (float): mean courses a student takes, sets the size of the student pool
+    zero_score_courses (float): share of courses whose final scores are all 0 (dropped by course_filter)
+    missing (dict): column -> fraction of missing values; user_id and submitted_at are allowed
+    seed (int): random seed, same arguments and seed give the same frame
+    """
+    rng = np.random.default_rng(seed)
+    if n_courses is None:
+        n_courses = max(1, int(round(n_rows / (enrollment * assignments * np.mean(submit_rate)))))
+
+    # course shapes; sigma 0.6 lognormal with the requested mean
+    sizes = np.maximum(1, np.round(rng.lognormal(np.log(enrollment) - 0.18, 0.6, n_courses))).astype(np.int64)
+    n_assign = 1 + rng.poisson(max(assignments - 1, 0), n_courses)
+    n_users = max(int(sizes.max()), int(sizes.sum() / courses_per_student))
+
+    # student-course enrollments: a contiguous run of the shuffled student pool per course
+    enroll_course = np.repeat(np.arange(n_courses), sizes)
+    enroll_local = np.arange(len(enroll_course)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    pool = rng.permutation(n_users)
+    enroll_user = pool[(rng.integers(0, n_users, n_courses)[enroll_course] + enroll_local) % n_users]
+    scores = np.clip(rng.normal(80, 12, len(enroll_course)), 0, 100).round(2)
+    scores[rng.random(n_courses)[enroll_course] < zero_score_courses] = 0.0
+
+    # assignments: due dates spread over a term starting on a course specific monday
+    assign_start = np.cumsum(n_assign) - n_assign
+    assign_course = np.repeat(np.arange(n_courses), n_assign)
+    term_start = np.datetime64('2019-01-07') + 7 * rng.integers(0, 150, n_courses).astype('timedelta64[D]')
+    due = (term_start[assign_course] + rng.integers(1, 110, len(assign_course)).astype('timedelta64[D]')
+           + np.timedelta64(23 * 3600 + 59 * 60, 's'))
+    rate = rng.uniform(submit_rate[0], submit_rate[1], len(assign_course))
+
+    # every (enrollment, assignment of its course) pair, kept with the assignment's submit rate
+    pairs = sizes * n_assign
+    pair_course = np.repeat(np.arange(n_courses), pairs)
+    offset = np.arange(pairs.sum()) - np.repeat(np.cumsum(pairs) - pairs, pairs)
+    enrollment_idx = (np.cumsum(sizes) - sizes)[pair_course] + offset // n_assign[pair_course]
+    assignment_idx = assign_start[pair_course] + offset % n_assign[pair_course]
+    keep = rng.random(len(offset)) < rate[assignment_idx]
+    enrollment_idx, assignment_idx = enrollment_idx[keep], assignment_idx[keep]
+    users = enroll_user[enrollment_idx]
+
+    # lead time before the deadline: per student procrastination times noise, some late
+    habit = rng.lognormal(0, 0.8, n_users)
+    lead = rng.exponential(1.0, len(users)) * habit[users] * 86400
+    lead[rng.random(len(users)) < 0.05] *= -0.1
+    due_dates = due[assignment_idx]
+    submitted = due_dates - lead.astype('timedelta64[s]')
+
+    course_ids = 10000 + np.arange(n_courses)
+    courses = course_ids[pair_course[keep]]
+    names = np.array(['Course {}'.format(c) for c in course_ids], dtype=object)
+    # demographics are fixed per student
+    ethnicity = np.array(ETHNICITIES, dtype=object)[rng.choice(len(ETHNICITIES), n_users, p=ETHNICITY_WEIGHTS)]
+    gender = np.array(['F', 'M'], dtype=object)[rng.integers(0, 2, n_users)]
+    urm = np.array(['N', 'Y'], dtype=object)[(rng.random(n_users) < 0.25).astype(int)]
+    first_gen = np.array(['N', 'Y'], dtype=object)[(rng.random(n_users) < 0.3).astype(int)]
+
+    data = pd.DataFrame({
+        'submitted_at': submitted,
+        'due_date': due_dates,
+        'course_id': courses,
+        'course_name': names[pair_course[keep]],
+        'user_id': 100000 + users,
+        'assignment_id': 1000000 + assignment_idx,
+        'final_score': scores[enrollment_idx],
+        'ethnicity': ethnicity[users],
+        'gender': gender[users],
+        'is_a_urm': urm[users],
+        'first_gen_status': first_gen[users],
+    })
+    for col, frac in missing.items():
+        if frac > 0:
+            # demographics are missing for a student, everything else for single rows
+            if col in ['ethnicity', 'gender', 'is_a_urm', 'first_gen_status']:
+                mask = (rng.random(n_users) < frac)[users]
+            else:
+                mask = rng.random(len(data)) < frac
+            data.loc[mask, col] = np.nan
+    return data
@@ -1,6 +1,38 @@
+import json
+import os
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import ThreadedConnectionPool
 from sshtunnel import SSHTunnelForwarder
 from private.private import private
+from clean.ingest import write_extract, write_extract_delta
+
+INCREMENTAL_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sql", "submissions_incremental.sql")
+
+# postgres type oid -> arrow type for streamed COPY results (anything else is read as string)
+PG_ARROW_TYPES = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    700: pa.float32(),
+    701: pa.float64(),
+    1700: pa.float64(),
+    1082: pa.date32(),
+    1114: pa.timestamp("us"),
+    1184: pa.timestamp("us", tz="UTC"),
+}
+
+_cursor_ids = itertools.count()  # named cursors must be unique per connection
+
 
 class Client:
     def __init__(self, host, username, password):
@@ -15,16 +47,31 @@ class Client:
         self.server.start()
         self.binded_port = self.server.local_bind_port
         print('server connected')
-        self.conn = psycopg2.connect(
+        self.conn_kwargs = dict(
             user=private.psql_user, host=private.ip, port=self.binded_port, database=private.db
         )
+        self.conn = psycopg2.connect(**self.conn_kwargs)
+        print("database connected")
+
+    @classmethod
+    def local(cls, **conn_kwargs):
+        """
+        client for a postgres reachable without the ssh tunnel (e.g. a local stand-in for testing)
+        conn_kwargs: psycopg2.connect arguments
+        """
+        client = cls.__new__(cls)
+        client.server = None
+        client.conn_kwargs = conn_kwargs
+        client.conn = psycopg2.connect(**conn_kwargs)
         print("database connected")
+        return client
 
     def close_connection(self):
         self.conn.close()
         print('db connection closed')
-        self.server.stop()
-        print('server connection closed')
+        if self.server is not None:
+            self.server.stop()
+            print('server connection closed')
 
     def query_to_csv(self, query, file_name):
         """
@@ -48,4 +95,226 @@ class Client:
         cur = self.conn.cursor()
         cur.execute(query)
         res = cur.fetchall()
-        return res 
\ No newline at end of file
+        return res
+
+    def query_iter(self, query, batch_size=10000, as_frame=False):
+        """
+        Executes query on a named (server-side) cursor and yields results batch_size rows at a
+        time, as lists of tuples or (as_frame) panda dataframes; client memory stays one batch
+        """
+        opened = self._idle()
+        cur = self.conn.cursor(name="query_iter_{}".format(next(_cursor_ids)))
+        cur.itersize = batch_size
+        try:
+            cur.execute(query)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                if as_frame:
+                    yield pd.DataFrame.from_records(rows, columns=[col.name for col in cur.description])
+                else:
+                    yield rows
+        finally:
+            cur.close()
+            if opened:
+                self.conn.rollback()  # a named cursor lives in a transaction; read only, nothing to keep
+
+    def _idle(self):
+        """
+        True if no transaction is open on conn, so the one the next statement opens belongs to the
+        calling method and rolling it back discards none of the caller's uncommitted work
+        """
+        return self.conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+
+    def key_partitions(self, query, key="course_id", n_partitions=8):
+        """
+        splits the distinct values of key in query's result into n_partitions contiguous
+        (low, high) ranges with about as many keys each; None (rows with null key) is added last if present
+        """
+        cur = self.conn.cursor()
+        cur.execute(
+            sql.SQL("SELECT DISTINCT q.{key} FROM ({query}) q ORDER BY 1").format(
+                key=sql.Identifier(key), query=sql.SQL(query)
+            )
+        )
+        keys = [row[0] for row in cur.fetchall()]
+        cur.close()
+
+        has_null = len(keys) > 0 and keys[-1] is None  # nulls sort last
+        keys = keys[:-1] if has_null else keys
+        size = -(-len(keys) // n_partitions) if keys else 0
+        partitions = [(keys[i], keys[min(i + size, len(keys)) - 1]) for i in range(0, len(keys), max(size, 1))]
+        if has_null:
+            partitions.append(None)
+        return partitions
+
+    def query_to_csv_partitioned(self, query, directory, key="course_id", partitions=None, n_partitions=8, workers=4):
+        """
+        exports query as one csv per key range, copied concurrently over a pool of
+        connections (all through the same ssh tunnel)
+        partitions (list): (low, high) inclusive key ranges, None for rows with a null key;
+                           defaults to key_partitions(query, key, n_partitions)
+        workers (int): number of connections
+        writes directory/part-#####.csv and directory/manifest.json, returns manifest (dict)
+        """
+        if partitions is None:
+            partitions = self.key_partitions(query, key, n_partitions)
+        os.makedirs(directory, exist_ok=True)
+
+        pool = ThreadedConnectionPool(1, workers, **self.conn_kwargs)
+        print("connection pool opened ({} connections)".format(workers))
+
+        def export(i):
+            conn = pool.getconn()
+            try:
+                cur = conn.cursor()
+                if partitions[i] is None:
+                    where = sql.SQL("q.{} IS NULL").format(sql.Identifier(key))
+                else:
+                    where = sql.SQL("q.{} BETWEEN {} AND {}").format(
+                        sql.Identifier(key), sql.Literal(partitions[i][0]), sql.Literal(partitions[i][1])
+                    )
+                outputquery = sql.SQL("COPY (SELECT * FROM ({query}) q WHERE {where}) TO STDOUT WITH CSV HEADER").format(
+                    query=sql.SQL(query), where=where
+                )
+                file_name = "part-{:05d}.csv".format(i)
+                with open(os.path.join(directory, file_name), "w") as f:
+                    cur.copy_expert(outputquery, f)
+                rows = cur.rowcount
+                cur.close()
+                conn.commit()
+            finally:
+                pool.putconn(conn)
+            print("partition {} exported ({} rows)".format(i, rows))
+            low, high = (None, None) if partitions[i] is None else partitions[i]
+            return {"file": file_name, "low": low, "high": high, "null_key": partitions[i] is None, "rows": rows}
+
+        try:
+            with ThreadPoolExecutor(workers) as executor:
+                exported = list(executor.map(export, range(len(partitions))))
+        finally:
+            pool.closeall()
+            print("connection pool closed")
+
+        manifest = {"query": query, "key": key, "partitions": exported}
+        with open(os.path.join(directory, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2, default=str)
+        return manifest
+
+    def query_batches(self, query, block_size=64 << 20, keep_transaction=False):
+        """
+        streams query through COPY ... TO STDOUT and yields arrow RecordBatches of about block_size bytes
+        of csv each; column types come from the query's result description (timestamps, ints native)
+        keep_transaction (bool): leave the transaction open after a completed copy (the caller commits)
+        a transaction the caller already had open is never rolled back here, even if the copy fails
+        """
+        opened = self._idle()
+        cur = self.conn.cursor()
+        try:
+            cur.execute(sql.SQL("SELECT * FROM ({}) q LIMIT 0").format(sql.SQL(query)))
+        except psycopg2.Error:
+            if opened:
+                self.conn.rollback()
+            raise
+        names = [col.name for col in cur.description]
+        types = {col.name: PG_ARROW_TYPES.get(col.type_code, pa.string()) for col in cur.description}
+        cur.close()
+
+        read_fd, write_fd = os.pipe()
+        reader, writer = os.fdopen(read_fd, "rb"), os.fdopen(write_fd, "wb")
+        failure = []
+
+        def copy():
+            cur = self.conn.cursor()
+            try:
+                cur.execute("SHOW TIME ZONE")
+                time_zone = cur.fetchone()[0]
+                cur.execute("SET LOCAL TIME ZONE 'UTC'")
+                outputquery = sql.SQL("COPY ({}) TO STDOUT WITH CSV HEADER").format(sql.SQL(query))
+                cur.copy_expert(outputquery, writer)
+                cur.execute("SET LOCAL TIME ZONE %s", (time_zone,))
+            except Exception as e:  # reader gone (consumer stopped early) or query failed
+                failure.append(e)
+            finally:
+                cur.close()
+                try:
+                    writer.close()
+                except OSError:
+                    pass
+
+        thread = threading.Thread(target=copy, daemon=True)
+        thread.start()
+        print("executing streamed copy")
+        completed = False
+        try:
+            batches = pa_csv.open_csv(
+                reader,
+                read_options=pa_csv.ReadOptions(block_size=block_size),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types=types,
+                    include_columns=names,
+                    true_values=["t"],
+                    false_values=["f"],
+                    strings_can_be_null=True,  # unquoted empty field is NULL in COPY csv
+                    quoted_strings_can_be_null=False,
+                ),
+            )
+            n_batches = 0
+            for batch in batches:
+                n_batches += 1
+                yield batch
+            if n_batches == 0:
+                # RecordBatch.from_pylist needs pyarrow >= 7
+                yield pa.RecordBatch.from_arrays([pa.array([], f.type) for f in batches.schema], schema=batches.schema)
+            completed = True
+        finally:
+            reader.close()
+            thread.join()
+            if opened and (failure or not completed or not keep_transaction):
+                self.conn.rollback()  # read only: ends the copy's transaction (and a failed one)
+        if failure:
+            raise failure[0]
+
+    def query_to_df(self, query, block_size=64 << 20, keep_transaction=False):
+        """
+        executes query and returns typed panda dataframe of the result, decoded from a streamed
+        COPY in block_size chunks without an intermediate file
+        e.g. SubmissionData(columns, file=None, data=client.query_to_df(query))
+        """
+        return pa.Table.from_batches(list(self.query_batches(query, block_size, keep_transaction))).to_pandas()
+
+    def query_to_extract(self, query, directory, block_size=64 << 20):
+        """
+        streams query (e.g. SELECT * FROM submissions) into a local parquet extract (clean.ingest),
+        the base that refresh_submissions adds deltas to
+        """
+        write_extract(directory, self.query_batches(query, block_size))
+        print("extract written: {}".format(directory))
+
+    def refresh_submissions(self, extract_dir=None):
+        """
+        incremental refresh: runs sql/submissions_incremental.sql, which reloads only the submissions
+        changed since the last refresh or build (submission_dim and course_score_dim update timestamps)
+        and deletes the ones that disappeared
+        extract_dir (str): local extract (query_to_extract) the same delta is added to, before commit
+        returns number of changed submission ids
+        """
+        cur = self.conn.cursor()
+        try:
+            with open(INCREMENTAL_SQL) as f:
+                cur.execute(f.read())
+            cur.execute("SELECT submission_id FROM submissions_changed")
+            changed_ids = [row[0] for row in cur.fetchall()]
+            print("submissions changed since last refresh: {}".format(len(changed_ids)))
+            if extract_dir is not None:
+                delta = self.query_to_df("SELECT * FROM submissions_delta", keep_transaction=True)
+                name = write_extract_delta(extract_dir, delta, changed_ids)
+                print("extract delta written: {} ({} rows)".format(name, len(delta)))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+        return len(changed_ids)
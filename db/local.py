@@ -0,0 +1,190 @@
+"""
+Offline builds of the db/sql views and tables on DuckDB, over local parquet snapshots of the
+Canvas Data tables instead of the remote postgres (no ssh tunnel, multi-threaded, no shared server)
+
+python -m db.local snapshots/ --database canvas.duckdb --extract submissions_extract/
+"""
+import argparse
+import os
+import re
+import time
+
+from clean.ingest import write_extract
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sql")
+
+# scripts of a full build, in dependency order (submissions reads the course meta views)
+BUILD_SCRIPTS = ["course_assignments.sql", "course_enrollments.sql", "course_submissions.sql", "submissions_lvl.sql"]
+
+# tables the build scripts read, one snapshot each: <name>.parquet or a directory <name>/ of parquet files
+SNAPSHOT_TABLES = [
+    "submission_dim", "submission_fact", "assignment_dim", "course_dim", "enrollment_dim",
+    "user_dim", "pseudonym_dim", "STU_ENROLLMENT", "course_score_fact", "course_score_dim",
+]
+
+# course meta the submissions build filters on; a server-side table, so without a snapshot of it the
+# local build can only join the three course meta views (unfiltered, see LocalClient.build)
+COURSE_META_FILTERED = """
+CREATE OR REPLACE VIEW z_course_meta_filtered_netids AS
+SELECT a.course_canvas_id, a.assignments, e.enrollments, s.submissions
+FROM course_meta_assignments a
+LEFT JOIN course_meta_enrollments e ON e.course_canvas_id = a.course_canvas_id
+LEFT JOIN course_meta_submissions s ON s.course_canvas_id = a.course_canvas_id
+"""
+
+# postgres -> duckdb rewrites: (pattern, replacement). DISTINCT ON, quoted identifiers, != and
+# CREATE TABLE AS run unchanged.
+DIALECT = [
+    # postgres accepts course_dim columns grouped only by its primary key (functional dependency),
+    # duckdb needs every selected column grouped: GROUP BY ALL groups by the same columns
+    (re.compile(r"GROUP BY\s+course_canvas_id\b[^;]*?(?=\s*ORDER BY)", re.IGNORECASE), "GROUP BY ALL"),
+]
+
+
+def duckdb_sql(script):
+    """
+    returns a db/sql script (text) with the DIALECT rewrites applied
+    """
+    for pattern, replacement in DIALECT:
+        script = pattern.sub(replacement, script)
+    return script
+
+
+class LocalClient:
+    """
+    Client (db.connection) stand-in on DuckDB: the same query helpers, and build() to run the
+    db/sql scripts over the snapshot tables
+    """
+    def __init__(self, snapshot_dir, database=":memory:", threads=None):
+        """
+        snapshot_dir (str): directory with a parquet snapshot per table (see SNAPSHOT_TABLES)
+        database (str): duckdb file the built views/tables are kept in, default in memory
+        threads (int): duckdb worker threads, default all cores
+        """
+        import duckdb  # only needed for local builds
+
+        self.conn = duckdb.connect(database)
+        if threads is not None:
+            self.conn.execute("PRAGMA threads={}".format(int(threads)))
+        self.snapshots = self.register_snapshots(snapshot_dir)
+        print("local database opened ({} snapshot tables)".format(len(self.snapshots)))
+
+    def register_snapshots(self, snapshot_dir):
+        """
+        creates a view per parquet snapshot in snapshot_dir, named after the file (or directory)
+        returns {table: path}
+        """
+        snapshots = {}
+        for entry in sorted(os.listdir(snapshot_dir)):
+            path = os.path.join(snapshot_dir, entry)
+            if os.path.isdir(path):
+                name, source = entry, os.path.join(path, "*.parquet")
+            elif entry.endswith(".parquet"):
+                name, source = entry[: -len(".parquet")], path
+            else:
+                continue
+            self.conn.execute(
+                'CREATE OR REPLACE VIEW "{}" AS SELECT * FROM read_parquet({})'.format(name, _literal(source))
+            )
+            snapshots[name] = path
+        return snapshots
+
+    def close_connection(self):
+        self.conn.close()
+        print("local database closed")
+
+    def run_script(self, script):
+        """
+        runs a db/sql script (file name in db/sql or a path) with the DIALECT rewrites
+        """
+        path = script if os.path.exists(script) else os.path.join(SQL_DIR, script)
+        with open(path) as f:
+            self.conn.execute(duckdb_sql(f.read()))
+
+    def build(self, scripts=BUILD_SCRIPTS, unfiltered_course_meta=False):
+        """
+        runs scripts in order (default the course meta views and the submissions table)
+        unfiltered_course_meta (bool): without a z_course_meta_filtered_netids snapshot, build the
+                                       submissions table on the unfiltered course meta views
+                                       (COURSE_META_FILTERED) instead of raising
+        """
+        missing = [table for table in SNAPSHOT_TABLES if table not in self.snapshots]
+        if missing:
+            raise ValueError("missing snapshot tables: {}".format(", ".join(missing)))
+        unfiltered = "z_course_meta_filtered_netids" not in self.snapshots and any(
+            os.path.basename(script) == "submissions_lvl.sql" for script in scripts
+        )
+        if unfiltered and not unfiltered_course_meta:
+            raise ValueError(
+                "missing snapshot table z_course_meta_filtered_netids "
+                "(unfiltered_course_meta=True builds on the unfiltered course meta views)"
+            )
+        for script in scripts:
+            if unfiltered and os.path.basename(script) == "submissions_lvl.sql":
+                print("warning: no z_course_meta_filtered_netids snapshot, "
+                      "submissions are built on the unfiltered course meta views")
+                self.conn.execute(COURSE_META_FILTERED)
+            start = time.perf_counter()
+            self.run_script(script)
+            print("{} built ({:.1f} s)".format(script, time.perf_counter() - start))
+
+    def query(self, query):
+        """
+        Executes query and returns as Python object
+        """
+        return self.conn.execute(query).fetchall()
+
+    def query_to_df(self, query):
+        """
+        executes query and returns panda dataframe of the result
+        e.g. SubmissionData(columns, file=None, data=client.query_to_df(query))
+        """
+        return self.conn.execute(query).fetchdf()
+
+    def query_to_csv(self, query, file_name):
+        """
+        writes query's result to file_name as csv with header
+        """
+        self.conn.execute("COPY ({}) TO {} (HEADER)".format(query, _literal(file_name)))
+        return file_name
+
+    def query_to_extract(self, query, directory, batch_size=1 << 20):
+        """
+        streams query (e.g. SELECT * FROM submissions) into a local parquet extract (clean.ingest)
+        """
+        write_extract(directory, _record_batch_reader(self.conn.execute(query), batch_size))
+        print("extract written: {}".format(directory))
+
+
+def _record_batch_reader(result, batch_size):
+    """
+    arrow RecordBatchReader of an executed query: to_arrow_reader from duckdb 1.5 (fetch_record_batch
+    is deprecated there), fetch_record_batch on the older releases python 3.8 installs
+    """
+    if hasattr(result, "to_arrow_reader"):
+        return result.to_arrow_reader(batch_size)
+    return result.fetch_record_batch(batch_size)
+
+
+def _literal(value):
+    return "'{}'".format(value.replace("'", "''"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("snapshots", help="directory with a parquet snapshot per Canvas Data table")
+    parser.add_argument("--database", default=":memory:", help="duckdb file to keep the built views and tables in")
+    parser.add_argument("--threads", type=int, default=None, help="duckdb worker threads, default all cores")
+    parser.add_argument("--scripts", nargs="+", default=BUILD_SCRIPTS, help="db/sql scripts to run, in order")
+    parser.add_argument("--extract", help="also write the submissions table to this local extract directory")
+    parser.add_argument("--unfiltered-course-meta", action="store_true",
+                        help="without a z_course_meta_filtered_netids snapshot, build on the unfiltered course meta views")
+    args = parser.parse_args()
+
+    client = LocalClient(args.snapshots, args.database, args.threads)
+    try:
+        client.build(args.scripts, args.unfiltered_course_meta)
+        if args.extract:
+            client.query_to_extract("SELECT * FROM submissions", args.extract)
+    finally:
+        client.close_connection()
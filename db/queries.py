@@ -0,0 +1,127 @@
+"""
+SQL builders for exporting only the rows that survive a SubmissionData configuration
+"""
+
+# columns computed by the filters, exported alongside the requested ones (SubmissionData(filtered=True))
+FILTER_COLUMNS = ["course_size", "course_mean", "n_assignments"]
+
+
+def filter_ctes(a_thres=0.5, s_thres=0.5, filtered=False):
+    """
+    returns the common table expressions (comma separated, to follow a base CTE with submission
+    level rows in a WITH clause) of the course, assignment and student filters:
+    s3 holds the surviving rows with course_size, course_mean and n_assignments, and
+    course_invariants the validate_n_stud_assign counts per course (see invariant_condition).
+    Shared by filtered_submissions_query (postgres) and clean.backend.pipeline_query (DuckDB),
+    so it only uses SQL both run.
+
+    filtered (bool): base was exported with filtered_submissions_query, s3 only drops courseless rows
+
+    COUNT(DISTINCT ...) is not available as a window function in postgres, so the group
+    statistics are grouped CTEs joined back on their keys. Groups with a missing key are
+    left out and inner joins drop their rows, like groupby().filter. Thresholds are compared
+    in double precision, as in pandas.
+    """
+    if filtered:
+        filters = """
+s3 AS (
+  SELECT * FROM base WHERE course_id IS NOT NULL
+),"""
+    else:
+        filters = """
+course_stats AS (
+  SELECT course_id,
+         COUNT(DISTINCT user_id) AS course_size,
+         AVG(final_score) AS course_mean
+  FROM base
+  WHERE course_id IS NOT NULL
+  GROUP BY course_id
+),
+course_filtered AS (
+  -- aggegate_class_stats_join, course_filter (a course without any final_score keeps a null mean and is kept)
+  SELECT b.*, cs.course_size, cs.course_mean
+  FROM base b
+  INNER JOIN course_stats cs ON cs.course_id = b.course_id
+  WHERE cs.course_mean IS DISTINCT FROM 0
+),
+assignment_stats AS (
+  -- an assignment belongs to one course, so its course_size is unique
+  SELECT assignment_id,
+         COUNT(DISTINCT user_id) AS n_submitters,
+         MIN(course_size) AS course_size
+  FROM course_filtered
+  WHERE assignment_id IS NOT NULL
+  GROUP BY assignment_id
+),
+assignment_filtered AS (
+  -- assignment_filter
+  SELECT cf.*
+  FROM course_filtered cf
+  INNER JOIN assignment_stats ast ON ast.assignment_id = cf.assignment_id
+  WHERE CAST(ast.n_submitters AS double precision) / ast.course_size > CAST({a_thres!r} AS double precision)
+),
+course_assignments AS (
+  SELECT course_id, COUNT(DISTINCT assignment_id) AS n_assignments
+  FROM assignment_filtered
+  GROUP BY course_id
+),
+student_assignments AS (
+  SELECT user_id, course_id, COUNT(DISTINCT assignment_id) AS n_submitted
+  FROM assignment_filtered
+  WHERE user_id IS NOT NULL
+  GROUP BY user_id, course_id
+),
+s3 AS (
+  -- student_filter
+  SELECT af.*, ca.n_assignments
+  FROM assignment_filtered af
+  INNER JOIN course_assignments ca ON ca.course_id = af.course_id
+  INNER JOIN student_assignments sa ON sa.user_id = af.user_id AND sa.course_id = af.course_id
+  WHERE sa.n_submitted > FLOOR(ca.n_assignments * CAST({s_thres!r} AS double precision))
+),""".format(a_thres=float(a_thres), s_thres=float(s_thres))
+    return filters + """
+course_invariants AS (
+  -- validate_n_stud_assign
+  SELECT course_id,
+         COUNT(DISTINCT assignment_id) AS n_assignments_updated,
+         COUNT(DISTINCT user_id) AS n_students_updated
+  FROM s3
+  GROUP BY course_id
+)"""
+
+
+def invariant_condition(a_n=5, s_n=20, alias="ci"):
+    """
+    returns the condition on course_invariants (as alias) of the a_n/s_n invariants
+    """
+    return "{alias}.n_students_updated > {s_n} AND {alias}.n_assignments_updated > {a_n}".format(
+        alias=alias, s_n=int(s_n), a_n=int(a_n)
+    )
+
+
+def filtered_submissions_query(columns, a_n=5, s_n=20, a_thres=0.5, s_thres=0.5, table="submissions"):
+    """
+    returns select over table applying the SubmissionData course, assignment and student filters
+    and the a_n/s_n invariants, e.g. client.query_to_csv(filtered_submissions_query(columns), file)
+
+    columns (list): submission columns to export (must include course_id, user_id,
+                    assignment_id and final_score); FILTER_COLUMNS are appended
+    table (str): table or parenthesized subquery with submission level rows
+    """
+    select = ", ".join('"{}"'.format(col) for col in columns)
+    qualified = ", ".join('s3."{}"'.format(col) for col in columns)
+    return """
+WITH base AS (
+  SELECT {select} FROM {table}
+),{filters}
+SELECT {qualified}, s3.course_size, s3.course_mean, s3.n_assignments
+FROM s3
+INNER JOIN course_invariants ci ON ci.course_id = s3.course_id
+WHERE {invariants}
+""".format(
+        select=select,
+        qualified=qualified,
+        table=table,
+        filters=filter_ctes(a_thres, s_thres),
+        invariants=invariant_condition(a_n, s_n),
+    )
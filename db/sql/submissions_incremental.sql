@@ -0,0 +1,146 @@
+-- incremental refresh of submissions (built by submissions_lvl.sql)
+-- reloads the submissions changed since the previous refresh (or build), found from the Canvas Data
+-- update timestamps recorded in submissions_watermarks (latest updated_at seen per source table);
+-- without a recorded watermark every submission counts as changed
+-- submissions_changed / submissions_delta are kept until commit, to export the delta to the local extract
+
+CREATE TABLE IF NOT EXISTS submissions_watermarks (
+  source text,
+  updated_at timestamp
+);
+
+-- watermarks of this refresh, read before the changes: a row updated while it runs is reloaded again next time
+CREATE TEMP TABLE submissions_watermarks_next ON COMMIT DROP AS
+SELECT 'submission_dim'::text AS source, MAX(updated_at) AS updated_at FROM submission_dim
+UNION ALL
+SELECT 'course_score_dim'::text, MAX(updated_at) FROM course_score_dim;
+
+CREATE TEMP TABLE submissions_changed ON COMMIT DROP AS
+-- new, resubmitted, regraded (grade_matches_current_submission and the submission_fact scores) and
+-- unsubmitted submissions: any change to a submission updates its submission_dim.updated_at
+SELECT
+  sd.id AS submission_id
+FROM
+  submission_dim sd
+WHERE
+  sd.updated_at > COALESCE(
+    (SELECT updated_at FROM submissions_watermarks WHERE source = 'submission_dim'), '-infinity')
+UNION
+-- changed course scores (current_score, final_score): every submission of the student in the course
+SELECT
+  sd.id
+FROM
+  course_score_dim csd
+  INNER JOIN course_score_fact csf ON csf.score_id = csd.id
+  INNER JOIN enrollment_dim ed ON ed.id = csf.enrollment_id
+  INNER JOIN assignment_dim ad ON ad.course_id = ed.course_id
+  INNER JOIN submission_dim sd ON sd.assignment_id = ad.id
+    AND sd.user_id = ed.user_id
+WHERE
+  csd.updated_at > COALESCE(
+    (SELECT updated_at FROM submissions_watermarks WHERE source = 'course_score_dim'), '-infinity')
+UNION
+-- submissions that disappeared from submission_dim
+SELECT
+  s.submission_id
+FROM
+  submissions s
+WHERE
+  NOT EXISTS (SELECT 1 FROM submission_dim sd WHERE sd.id = s.submission_id);
+
+CREATE TEMP TABLE submissions_delta ON COMMIT DROP AS
+WITH valid_stu_demographics AS (
+  SELECT DISTINCT ON ("anon-netid")
+    "anon-netid" AS anon_netid,
+    "EFFDT_GENDER" AS gender,
+    "ST_ETHNIC_IPEDS" AS ethnicity,
+    "ST_URM_FLAG" AS is_a_urm,
+    "FIRST_GENERATION" AS first_gen_status
+  FROM
+    "STU_ENROLLMENT"
+),
+valid_enrollment AS (
+  SELECT DISTINCT ON (user_id,
+    course_id)
+    id,
+    user_id,
+    course_id,
+    type,
+    workflow_state
+  FROM
+    enrollment_dim
+)
+SELECT DISTINCT
+  sd.id AS submission_id,
+  cd.id AS course_id,
+  cd.name AS course_name,
+  ad.title AS title,
+  ad.id AS assignment_id,
+  ad.due_at AS due_date,
+  sd.submitted_at AS submitted_at,
+  sd.grade AS sd_grade,
+  sd.attempt AS attempts,
+  sd.submission_type,
+  ud.id AS user_id,
+  sf.score AS score,
+  sf.published_score AS published_score,
+  ad.points_possible AS points_possible,
+  vsd.gender,
+  vsd.ethnicity,
+  vsd.is_a_urm,
+  vsd.first_gen_status,
+  csf.current_score,
+  csf.final_score,
+  ve.id,
+  ve.type,
+  ve.workflow_state
+FROM
+  submission_dim sd
+  INNER JOIN submissions_changed sc ON sc.submission_id = sd.id
+  INNER JOIN submission_fact sf ON sf.submission_id = sd.id
+  LEFT JOIN assignment_dim ad ON ad.id = sd.assignment_id
+  LEFT JOIN course_dim cd ON cd.id = ad.course_id
+  LEFT JOIN user_dim ud ON ud.id = sd.user_id
+  LEFT JOIN pseudonym_dim pd ON pd.user_id = ud.id
+  LEFT JOIN valid_stu_demographics vsd ON vsd.anon_netid = pd.unique_name 
+  LEFT JOIN valid_enrollment ve ON ve.user_id = ud.id
+    AND ve.course_id = cd.id
+  LEFT JOIN course_score_fact csf ON csf.enrollment_id = ve.id
+WHERE
+  ad.course_id IN (
+    SELECT
+      course_canvas_id
+    FROM
+      z_course_meta_filtered_netids
+    WHERE
+      submissions IS NOT NULL
+      AND enrollments IS NOT NULL
+      AND assignments IS NOT NULL
+      AND assignments > 5
+      AND enrollments > 20
+      AND submissions > 100)
+  AND sd.submission_type IS NOT NULL
+  AND sd.submitted_at IS NOT NULL
+  AND sd.workflow_state != 'unsubmitted'
+  AND sd.grade_matches_current_submission
+  AND vsd.anon_netid IS NOT NULL;
+
+-- insert, update or delete: drop the old version of every changed submission, then load the delta
+-- (unsubmitted, no longer current and disappeared submissions have no row in it)
+DELETE FROM submissions s
+USING submissions_changed sc
+WHERE s.submission_id = sc.submission_id;
+
+INSERT INTO submissions
+SELECT * FROM submissions_delta;
+
+-- advance the watermarks (a source without rows keeps its previous one)
+DELETE FROM submissions_watermarks w
+USING submissions_watermarks_next n
+WHERE w.source = n.source
+  AND n.updated_at IS NOT NULL;
+
+INSERT INTO submissions_watermarks
+SELECT source, updated_at
+FROM submissions_watermarks_next
+WHERE updated_at IS NOT NULL;
@@ -1,4 +1,12 @@
 DROP TABLE IF EXISTS submissions;
+-- incremental refreshes (submissions_incremental.sql) continue from the sources as read by this build:
+-- their update watermarks are taken first, so a change made during the build is reloaded by the next refresh
+DROP TABLE IF EXISTS submissions_watermarks;
+
+CREATE TABLE submissions_watermarks AS
+SELECT 'submission_dim'::text AS source, MAX(updated_at) AS updated_at FROM submission_dim
+UNION ALL
+SELECT 'course_score_dim'::text, MAX(updated_at) FROM course_score_dim;
 
 CREATE TABLE submissions AS
 WITH valid_stu_demographics AS (
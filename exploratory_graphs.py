@@ -5,43 +5,63 @@ import numpy as np
 from enum import Enum
 import pandas as pd
 
+from graphs.kde import group_densities
+from graphs.stats import grouping_sets
+from graphs.students import STUDENT_BANDS, StudentIndex
+
 # Global Attributes
 sns.set_style("whitegrid")
 plt.rcParams["xtick.bottom"] = True
 plt.rcParams["ytick.left"] = True
 plt.rc("axes", edgecolor="black")
 
+# density matrix panels: column, title, (level, label) pairs, colors
+DENSITY_PANELS = [
+    ("gender", "Gender", [("M", "Male"), ("F", "Female")], ["lightblue", "pink"]),
+    ("first_gen_status", "First Generation", [("Y", "Y"), ("N", "N")], sns.color_palette("RdYlBu", n_colors=2)),
+    (
+        "ethnicity",
+        "Ethnicity",
+        [("White", "White"), ("Asian", "Asian"), ("Black", "Black"), ("Hispanic", "Hispanic")],
+        sns.color_palette("Dark2", n_colors=5),
+    ),
+]
+
+
+# se_plot groups (Graphs.se_plot(data, axis, col_name, Group.ALL))
+class Group(Enum):
+    GENDER = 0
+    ETHNICITY = 1
+    FG = 2
+    ALL = 4
+
+
+# ethnicities shown in se_plot(..., Group.ALL)
+SE_ETHNICITIES = ["Asian", "Black", "Hispanic", "White"]
+
 
 class Graphs:
     """
     Exploratory graph methods 
     """
-    def student_time_plot(data, save_pdf=False):
+    def student_time_plot(data, save_pdf=False, index=None):
         """
         course_id: id of course
+        index(StudentIndex): index of data, built if not given (reuse it across plots)
         """
-        mean_ranks = data.groupby(["user_id"])["assignment_percentile_ranks"].mean()
-        student_low = (
-            mean_ranks.where(mean_ranks < 0.25).dropna().sample(n=1, random_state=1)
-        )
-        student_med = (
-            mean_ranks.where((mean_ranks < 0.6) & (mean_ranks > 0.4))
-            .dropna()
-            .sample(n=1, random_state=1)
-        )
-        student_high = (
-            mean_ranks.where(mean_ranks > 0.75).dropna().sample(n=1, random_state=1)
-        )
+        index = StudentIndex(data) if index is None else index
+        students = index.sample_bands()
+        student_low, student_med, student_high = (students[label][0] for label, _, _ in STUDENT_BANDS)
 
         print(
             "student low: {}, \tstudent median: {}, \tstudent high: {}".format(
-                student_low.iloc[0], student_med.iloc[0], student_high.iloc[0]
+                index.mean_ranks[student_low], index.mean_ranks[student_med], index.mean_ranks[student_high]
             )
         )
 
-        low_stud_full = data[data["user_id"] == student_low._index[0]]
-        med_stud_full = data[data["user_id"] == student_med._index[0]]
-        high_stud_full = data[data["user_id"] == student_high._index[0]]
+        low_stud_full = index.submissions(student_low)
+        med_stud_full = index.submissions(student_med)
+        high_stud_full = index.submissions(student_high)
 
         print(len(low_stud_full), len(med_stud_full), len(high_stud_full))
 
@@ -49,7 +69,7 @@ class Graphs:
         labels = ["student 1", "student 2", "student 3"]
         for f, l in zip([low_stud_full, med_stud_full, high_stud_full], labels):
 
-            f = f.sort_values(by=["due_date"])
+            # index rows are already sorted by due_date
             f = f.drop_duplicates(subset=["due_date"])
             assignment_list = ["A" + str(k) for k in list(range(len(f["due_date"])))]
 
@@ -78,20 +98,68 @@ class Graphs:
             )
         plt.show()
 
+    def student_band_plot(data, n=5, bands=STUDENT_BANDS, index=None, random_state=1, save_pdf=False, show=True):
+        """
+        submission time percentile ranks of n sampled students per percentile band, a panel per band
+        n(int): students per band
+        bands(list): (label, low, high) bands of mean percentile rank, see graphs.students
+        index(StudentIndex): index of data, built if not given (reuse it across plots)
+        returns figure
+        """
+        index = StudentIndex(data) if index is None else index
+        students = index.sample_bands(bands, n, random_state)
+        fig, axes = plt.subplots(
+            ncols=len(bands), figsize=(16 * len(bands) / 3, 5), sharey=True, squeeze=False
+        )
+        for ax, (label, low, high) in zip(axes[0], bands):
+            for user_id in students[label]:
+                f = index.timeline(user_id)
+                assignment_list = ["A" + str(k) for k in range(len(f))]
+                ax.plot(assignment_list, f[index.col_name].values, alpha=0.5, marker="o", markersize=4)
+            ax.set_title("{} (n={})".format(label, len(students[label])))
+            ax.set_xlabel("Assignment")
+            ax.tick_params(axis="x", rotation=315, labelsize=8)
+        axes[0][0].set_ylabel("Submission Time Percentile Rank")
+        fig.suptitle("Submission Time Percentile Ranks by Percentile Band")
+
+        if save_pdf:
+            fig.savefig(
+                "student_band_plot.pdf", format="pdf", bbox_inches="tight", dpi=200
+            )
+        if show:
+            plt.show()
+        return fig
+
     def course_p_score_dist(
-        data, course_id_lst, print_meta=False, group_meta_fn=None, save_pdf=False
+        data, course_id_lst, print_meta=False, group_meta_fn=None, save_pdf=False, n_rows=None, show=True
     ):
         """
         full_data(df) = submission level data of x number of courses
         print_meta(bool): print meta information for each course
         group_meta_fn(function):optional debug function for grouped data at course level
+        n_rows(int): rows of the figure (at least the number of courses), extra rows are left empty
+        show(bool): plt.show() the figure; batch rendering (graphs.render) saves it instead
+        returns figure
         """
         courses = data.groupby(["course_id", "course_name"], as_index=False)
-        plt.figure(figsize=(50, 60))
         n_courses = courses.ngroups
+        n_rows = n_courses if n_rows is None else max(n_rows, n_courses)
         fig, axes = plt.subplots(
-            ncols=3, nrows=n_courses, figsize=(14, 18), sharex=True, sharey=True
+            ncols=3, nrows=n_rows, figsize=(14, 18), sharex=True, sharey=True, squeeze=False
         )
+        for ax in axes[n_courses:].ravel():
+            ax.set_visible(False)
+        for ax in axes[n_courses - 1]:
+            ax.xaxis.set_tick_params(labelbottom=True)  # shared x labels would sit on the hidden rows
+
+        # densities of every (course, demographic group) pair, computed in one pass per panel
+        course_id_lst = list(course_id_lst)
+        courses_data = pd.concat([course_data for _, course_data in course_id_lst])
+        col_name = "procrastination_mean_rank"
+        panels = [
+            group_densities(courses_data, col_name, group, [level for level, _ in levels])
+            for group, _, levels, _ in DENSITY_PANELS
+        ]
 
         row_index = 0
 
@@ -108,44 +176,47 @@ class Graphs:
             ## Plotting
 
             if row_index == 0:
-                ax_row[0].set_title("Gender")
-                ax_row[1].set_title("First Generation")
-                ax_row[2].set_title("Ethnicity")
+                for ax, (_, title, _, _) in zip(ax_row, DENSITY_PANELS):
+                    ax.set_title(title)
 
             last_col = False
             if row_index == n_courses - 1:
                 # set legends
                 last_col = True
 
-            Graphs._gender_plot(data, ax_row, last_col, "procrastination_mean_rank")
-            Graphs._fg_plot(data, ax_row, last_col, "procrastination_mean_rank")
+            Graphs._gender_plot(panels[0], course[0], ax_row, last_col, col_name)
+            Graphs._fg_plot(panels[1], course[0], ax_row, last_col, col_name)
             Graphs._ethnicity_plot(
-                data, ax_row, course[1], last_col, "procrastination_mean_rank"
+                panels[2], course[0], ax_row, course[1], last_col, col_name
             )
             # pass course title because last graph in row
 
             row_index += 1
 
         if save_pdf:
-            plt.savefig("matrix_density_plots.pdf", format="pdf", bbox_inches="tight")
+            fig.savefig("matrix_density_plots.pdf", format="pdf", bbox_inches="tight")
 
-        plt.show()
+        if show:
+            plt.show()
+        return fig
 
-    def _gender_plot(data, ax_row, legend, col_name):
-        sns.kdeplot(
-            data[data["gender"] == "M"][col_name],
-            color="lightblue",
-            ax=ax_row[0],
-            label="Male",
-            clip=[0, 1],
-        )
-        sns.kdeplot(
-            data[data["gender"] == "F"][col_name],
-            color="pink",
-            ax=ax_row[0],
-            label="Female",
-            clip=[0, 1],
-        )
+    def _density_curves(densities, course_id, ax, panel, col_name):
+        """
+        draws precomputed curves of a DENSITY_PANELS panel (group_densities) for course_id
+        """
+        grid, curves = densities
+        _, _, levels, colors = DENSITY_PANELS[panel]
+        for (level, label), color in zip(levels, colors):
+            density = curves[course_id][level]
+            if np.isnan(density).all():
+                continue  # fewer than two values: sns.kdeplot draws nothing either
+            (line,) = ax.plot(grid, density, color=color, label=label)
+            line.sticky_edges.y[:] = [0]
+        ax.set_xlabel(col_name)
+        ax.set_ylabel("Density")
+
+    def _gender_plot(densities, course_id, ax_row, legend, col_name):
+        Graphs._density_curves(densities, course_id, ax_row[0], 0, col_name)
         if legend:
             ax_row[0].legend(
                 loc="upper center",
@@ -155,22 +226,8 @@ class Graphs:
                 ncol=2,
             )
 
-    def _fg_plot(data, ax_row, legend, col_name):
-        colors = sns.color_palette("RdYlBu", n_colors=2)
-        sns.kdeplot(
-            data[data["first_gen_status"] == "Y"][col_name],
-            color=colors[0],
-            ax=ax_row[1],
-            label="Y",
-            clip=[0, 1],
-        )
-        sns.kdeplot(
-            data[data["first_gen_status"] == "N"][col_name],
-            color=colors[1],
-            ax=ax_row[1],
-            label="N",
-            clip=[0, 1],
-        )
+    def _fg_plot(densities, course_id, ax_row, legend, col_name):
+        Graphs._density_curves(densities, course_id, ax_row[1], 1, col_name)
         if legend:
             ax_row[1].legend(
                 loc="upper center",
@@ -180,36 +237,8 @@ class Graphs:
                 ncol=2,
             )
 
-    def _ethnicity_plot(data, ax_row, course_name, legend, col_name):
-        colors = sns.color_palette("Dark2", n_colors=5)
-        sns.kdeplot(
-            data[data["ethnicity"] == "White"][col_name],
-            color=colors[0],
-            ax=ax_row[2],
-            label="White",
-            clip=[0, 1],
-        )
-        sns.kdeplot(
-            data[data["ethnicity"] == "Asian"][col_name],
-            color=colors[1],
-            ax=ax_row[2],
-            label="Asian",
-            clip=[0, 1],
-        )
-        sns.kdeplot(
-            data[data["ethnicity"] == "Black"][col_name],
-            color=colors[2],
-            ax=ax_row[2],
-            label="Black",
-            clip=[0, 1],
-        )
-        sns.kdeplot(
-            data[data["ethnicity"] == "Hispanic"][col_name],
-            color=colors[3],
-            ax=ax_row[2],
-            label="Hispanic",
-            clip=[0, 1],
-        )
+    def _ethnicity_plot(densities, course_id, ax_row, course_name, legend, col_name):
+        Graphs._density_curves(densities, course_id, ax_row[2], 2, col_name)
 
         wrapped_name = "\n".join(wrap(course_name, 12))
         text = ax_row[2].text(
@@ -238,49 +267,44 @@ class Graphs:
         group(str): parameter to group df by
         returns [names, means, std, se] of group wrt percentile_rank
         """
-        grouped_data = data.groupby(group, as_index=False)[col_name].agg(
-            [np.size, np.median, np.std]
-        )
-        names = list(data.groupby(group).groups)
-        means, std, se = (
-            list(grouped_data["median"].values),
-            list(grouped_data["std"].values),
-            list(grouped_data["std"].values / np.sqrt(grouped_data["size"]).values),
-        )
-        return names, means, std, se
+        return Graphs._stat_lists(grouping_sets(data, col_name, [group])[(group,)])
 
+    def _stat_lists(stats):
+        """
+        stats(df): one grouping set of graphs.stats.grouping_sets
+        returns [names, medians, std, se] lists
+        """
+        return (
+            list(stats.index),
+            list(stats["median"].values),
+            list(stats["std"].values),
+            list(stats["se"].values),
+        )
 
     def se_plot(data, axis, col_name, group):
         """
         generates statistics for each demographic group and plots the data along given axis
+        group(Group): demographic to plot, Group.ALL for all three
         """
-        class Group(Enum):
-            GENDER = 0
-            ETHNICITY = 1
-            FG = 2
-            ALL = 4
-
         colors = sns.color_palette("Dark2", n_colors=3)
 
+        # every demographic in one grouping-sets pass, cached for later calls on the same data
+        stats = grouping_sets(data, col_name, ["gender", "ethnicity", "first_gen_status"])
+        g_names, g_means, g_std, g_se = Graphs._stat_lists(stats[("gender",)])
+        fg_names, fg_means, fg_std, fg_se = Graphs._stat_lists(stats[("first_gen_status",)])
+        e_names, e_means, e_std, e_se = Graphs._stat_lists(stats[("ethnicity",)])
+
         if group == Group.ALL:
-            filtered_ethnicity_data = data.query(
-                "ethnicity == 'Black' | ethnicity == 'White'| ethnicity == 'Asian' | ethnicity == 'Hispanic'"
-            )
+            ethnicity_stats = stats[("ethnicity",)]
+            ethnicity_stats = ethnicity_stats[ethnicity_stats.index.isin(SE_ETHNICITIES)]
             print(
                 "Filtered {} rows (students not in ethnicity groups)".format(
-                    len(data) - len(filtered_ethnicity_data)
+                    len(data) - ethnicity_stats["size"].sum()
                 )
             )
-            g_names, g_means, g_std, g_se = Graphs._mean_std_count_group(data, "gender", col_name)
-            fg_names, fg_means, fg_std, fg_se = Graphs._mean_std_count_group(
-                data, "first_gen_status", col_name
-            )
-            e_names, e_means, e_std, e_se = Graphs._mean_std_count_group(
-                filtered_ethnicity_data, "ethnicity", col_name
-            )
+            e_names, e_means, e_std, e_se = Graphs._stat_lists(ethnicity_stats)
 
         if group == Group.GENDER:
-            g_names, g_means, g_std, g_se = Graphs._mean_std_count_group(data, "gender", col_name)
             axis.errorbar(
                 g_names,
                 g_means,
@@ -295,9 +319,6 @@ class Graphs:
             )
             return
         if group == Group.ETHNICITY:
-            e_names, e_means, e_std, e_se = Graphs._mean_std_count_group(
-                data, "ethnicity", col_name
-            )
             axis.errorbar(
                 e_names,
                 e_means,
@@ -312,9 +333,6 @@ class Graphs:
             )
             return
         if group == Group.FG:
-            fg_names, fg_means, fg_std, fg_se = Graphs._mean_std_count_group(
-                data, "first_gen_status", col_name
-            )
             axis.errorbar(
                 fg_names,
                 fg_means,
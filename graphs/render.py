@@ -0,0 +1,108 @@
+"""
+Batch rendering of the course density matrix (Graphs.course_p_score_dist): courses are split
+into pages, rendered headless (Agg) in a process pool, one pdf or png per page
+
+python -m graphs.render student_course_lvl.parquet figures --workers 4 --merge
+"""
+import argparse
+import multiprocessing
+import os
+
+import pandas as pd
+
+
+def course_pages(data, courses_per_page=8):
+    """
+    data (df): student_course_lvl from SubmissionData
+    returns list of pages, each a list of ((course_id, course_name), course df) in course order
+    """
+    courses = list(data.groupby(["course_id", "course_name"]))
+    return [courses[i:i + courses_per_page] for i in range(0, len(courses), courses_per_page)]
+
+
+def render_pages(data, directory, courses_per_page=8, fmt="pdf", workers=None, merge=False, dpi=150):
+    """
+    writes directory/page-#####.<fmt> for every page of courses_per_page courses
+    fmt (str): pdf or png
+    workers (int): rendering processes, default one per cpu
+    merge (bool): also write directory/pages.pdf with every page (pdf only, needs pypdf)
+    returns list of written paths, the merged file last
+    """
+    if merge and fmt != "pdf":
+        raise ValueError("merge needs fmt='pdf'")
+    os.makedirs(directory, exist_ok=True)
+    pages = course_pages(data, courses_per_page)
+    tasks = [
+        (os.path.join(directory, "page-{:05d}.{}".format(i, fmt)), page, courses_per_page, fmt, dpi)
+        for i, page in enumerate(pages)
+    ]
+
+    workers = min(workers or os.cpu_count(), len(tasks))
+    if workers <= 1:
+        # figures are saved and closed, never shown, whatever the caller's backend
+        paths = _collect(map(_render_page, tasks))
+    else:
+        with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+            paths = _collect(pool.imap(_render_page, tasks))
+
+    if merge:
+        paths.append(merge_pdfs(paths, os.path.join(directory, "pages.pdf")))
+    return paths
+
+
+def _collect(results):
+    paths = []
+    for path in results:
+        print("page written: {}".format(path))
+        paths.append(path)
+    return paths
+
+
+def merge_pdfs(paths, merged):
+    """
+    concatenates pdf files into merged, returns merged
+    """
+    from pypdf import PdfWriter  # only needed for merged output
+
+    writer = PdfWriter()
+    for path in paths:
+        writer.append(path)
+    with open(merged, "wb") as fh:
+        writer.write(fh)
+    return merged
+
+
+def _init_worker():
+    # headless: figures are only ever saved, nothing can block on a window
+    import matplotlib.pyplot as plt
+    plt.switch_backend("Agg")
+
+
+def _render_page(task):
+    import matplotlib.pyplot as plt
+    from exploratory_graphs import Graphs
+
+    path, page, n_rows, fmt, dpi = task
+    data = pd.concat([course_data for _, course_data in page])
+    fig = Graphs.course_p_score_dist(data, page, n_rows=n_rows, show=False)
+    fig.savefig(path, format=fmt, bbox_inches="tight", dpi=dpi)
+    plt.close(fig)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data", help="student_course_lvl as parquet or csv")
+    parser.add_argument("directory", help="output directory for the pages")
+    parser.add_argument("--per-page", type=int, default=8, help="courses per page")
+    parser.add_argument("--format", default="pdf", choices=["pdf", "png"])
+    parser.add_argument("--workers", type=int, default=None, help="rendering processes, default one per cpu")
+    parser.add_argument("--merge", action="store_true", help="also write every page into pages.pdf")
+    parser.add_argument("--dpi", type=int, default=150)
+    args = parser.parse_args()
+
+    if args.data.endswith(".parquet"):
+        data = pd.read_parquet(args.data)
+    else:
+        data = pd.read_csv(args.data)
+    render_pages(data, args.directory, args.per_page, args.format, args.workers, args.merge, args.dpi)
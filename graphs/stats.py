@@ -0,0 +1,98 @@
+"""
+Grouping-sets statistics: size, median, std and standard error of a column for several
+groupings (single demographics and crosses like gender x ethnicity) in one pass
+"""
+import numpy as np
+import pandas as pd
+
+from graphs.kde import frame_digest
+
+_cache = {}  # (frame digest, column) -> {grouping set: df}
+
+
+def grouping_sets(data, col_name, sets):
+    """
+    data (df): e.g. student_course_lvl
+    col_name (str): column the statistics are computed on
+    sets (list): grouping sets, each a column name or a tuple of them, e.g. ['gender', ('gender', 'ethnicity')]
+    returns {set: df} indexed by the set's (sorted) keys with size, median, std, se columns, matching
+    data.groupby(set)[col_name].agg([np.size, np.median, np.std]) and se = std / sqrt(size);
+    rows with a missing key in the set are left out, as groupby does
+    results are cached per frame contents and column
+    """
+    sets = [(s,) if isinstance(s, str) else tuple(s) for s in sets]
+    dims = list(dict.fromkeys(col for s in sets for col in s))
+    key = (frame_digest(data, dims + [col_name]), col_name)
+    cached = _cache.setdefault(key, {})
+    missing = [s for s in dict.fromkeys(sets) if s not in cached]
+    if missing:
+        cached.update(_compute(data, col_name, missing))
+    return {s: cached[s] for s in sets}
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def _compute(data, col_name, sets):
+    dims = list(dict.fromkeys(col for s in sets for col in s))
+    codes, levels = {}, {}
+    for dim in dims:
+        # sorted levels, as groupby; missing keys get the extra last slot of the cross
+        dim_codes, uniques = pd.factorize(data[dim], sort=True)
+        codes[dim] = np.where(dim_codes < 0, len(uniques), dim_codes)
+        levels[dim] = uniques
+    shape = tuple(len(levels[dim]) + 1 for dim in dims)
+    cross = np.ravel_multi_index([codes[dim] for dim in dims], shape)
+
+    # sizes and moments over the full cross once; each set sums out the other dimensions
+    values = data[col_name].values.astype(float)
+    valid = ~np.isnan(values)
+    n_cells = int(np.prod(shape))
+    mean = np.nanmean(values) if valid.any() else 0.0  # shift for a stable sum of squares
+    shifted = np.where(valid, values - mean, 0.0)
+    moments = [
+        np.bincount(cross, minlength=n_cells),
+        np.bincount(cross, weights=valid, minlength=n_cells),
+        np.bincount(cross, weights=shifted, minlength=n_cells),
+        np.bincount(cross, weights=shifted ** 2, minlength=n_cells),
+    ]
+    moments = [m.reshape(shape) for m in moments]
+
+    # values sorted once; per set, a stable sort of the group codes keeps them sorted within groups
+    order = np.argsort(values[valid], kind="stable")
+    sorted_values = values[valid][order]
+    sorted_codes = {dim: codes[dim][valid][order] for dim in dims}
+
+    results = {}
+    for s in sets:
+        axes = [dims.index(dim) for dim in s]
+        others = tuple(i for i in range(len(dims)) if i not in axes)
+        # summed out array keeps the set's axes in dims order: put them in set order, drop the missing-key slot
+        perm = [sorted(axes).index(i) for i in axes]
+        set_shape = tuple(shape[i] - 1 for i in axes)
+        keep = tuple(slice(0, n) for n in set_shape)
+        size, count, total, squares = [m.sum(axis=others).transpose(perm)[keep].ravel() for m in moments]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.sqrt(np.maximum((squares - total ** 2 / count) / (count - 1), 0))
+        std[count < 2] = np.nan
+
+        # medians: rows of the set's groups, in group order and value order within a group
+        present = np.all([sorted_codes[dim] < len(levels[dim]) for dim in s], axis=0)
+        group = np.ravel_multi_index([sorted_codes[dim][present] for dim in s], set_shape)
+        grouped = sorted_values[present][np.argsort(group, kind="stable")]
+        count = count.astype(np.int64)
+        starts = np.cumsum(count) - count
+        median = np.full(len(count), np.nan)
+        has = count > 0
+        median[has] = (grouped[starts[has] + (count[has] - 1) // 2] + grouped[starts[has] + count[has] // 2]) / 2
+
+        index = pd.MultiIndex.from_product([levels[dim] for dim in s], names=list(s))
+        frame = pd.DataFrame({"size": size, "median": median, "std": std}, index=index)
+        frame["se"] = frame["std"] / np.sqrt(frame["size"])
+        # groupby only has the key combinations that occur
+        frame = frame[frame["size"] > 0]
+        if len(s) == 1:
+            frame.index = frame.index.get_level_values(0)
+        results[s] = frame
+    return results
@@ -0,0 +1,82 @@
+"""
+Per-student index of a submission level frame: rows sorted by (user_id, due_date) once, with
+offsets so any student's submissions are a slice instead of a scan of the frame
+"""
+import numpy as np
+import pandas as pd
+
+# percentile bands of Graphs.student_time_plot: (label, lower bound, upper bound), exclusive
+STUDENT_BANDS = [("low", None, 0.25), ("median", 0.4, 0.6), ("high", 0.75, None)]
+
+
+class StudentIndex:
+    """
+    data sorted by user_id then due_date (ties keep their original order), offsets[i]:offsets[i + 1]
+    are the rows of users[i]; rows without a user_id are left out, as groupby does
+    """
+    def __init__(self, data, col_name="assignment_percentile_ranks"):
+        """
+        data (df): submission level frame with user_id, due_date and col_name
+        col_name (str): column averaged per student for the percentile bands
+        """
+        codes, users = pd.factorize(data["user_id"], sort=True)
+        order = np.lexsort((data["due_date"].values, codes))
+        order = order[codes[order] >= 0]
+        self.data = data.take(order)
+        self.users = users
+        self.offsets = np.searchsorted(codes[order], np.arange(len(users) + 1))
+        self.positions = pd.Index(users)
+        self.col_name = col_name
+
+        # mean of col_name per student from the sorted codes, nan values skipped as in groupby().mean()
+        values = self.data[col_name].values.astype(float)
+        valid = ~np.isnan(values)
+        sorted_codes = codes[order]
+        count = np.bincount(sorted_codes, weights=valid, minlength=len(users))
+        total = np.bincount(sorted_codes, weights=np.where(valid, values, 0), minlength=len(users))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.mean_ranks = pd.Series(total / count, index=pd.Index(users, name="user_id"), name=col_name)
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, user_id):
+        return user_id in self.positions
+
+    def submissions(self, user_id):
+        """
+        returns the student's rows, sorted by due_date
+        """
+        i = self.positions.get_loc(user_id)
+        return self.data.iloc[self.offsets[i]:self.offsets[i + 1]]
+
+    def timeline(self, user_id):
+        """
+        returns the student's submissions with one row per due_date (the first), as plotted
+        """
+        rows = self.submissions(user_id)
+        return rows.drop_duplicates(subset=["due_date"])
+
+    def band(self, low=None, high=None):
+        """
+        returns mean ranks of the students strictly between low and high (None: unbounded)
+        """
+        keep = self.mean_ranks.notna()
+        if low is not None:
+            keep &= self.mean_ranks > low
+        if high is not None:
+            keep &= self.mean_ranks < high
+        return self.mean_ranks[keep]
+
+    def sample(self, low=None, high=None, n=1, random_state=1):
+        """
+        returns n user ids sampled from band(low, high)
+        """
+        band = self.band(low, high)
+        return list(band.sample(n=min(n, len(band)), random_state=random_state).index)
+
+    def sample_bands(self, bands=STUDENT_BANDS, n=1, random_state=1):
+        """
+        returns {label: [user ids]} with n students sampled per (label, low, high) band
+        """
+        return {label: self.sample(low, high, n, random_state) for label, low, high in bands}
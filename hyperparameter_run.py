@@ -1,73 +1,125 @@
-from clean.clean_data import SubmissionData
+from clean.sweep import SubmissionSweep
+from model.results import ResultsStore, config_key
 import statsmodels.formula.api as smf
 import numpy as np
+import itertools
+import argparse
+import json
+import signal
+import sys
 
 data_file = './data/full_data_updated.csv'
+cache_dir = './data/cache'  # parquet copy of data_file, rebuilt when the csv changes
 columns = ['submitted_at', 'due_date', 'course_id', 'course_name', 'user_id', 'assignment_id',
             'final_score', 'ethnicity', 'gender', 'is_a_urm', 'first_gen_status']
+# one row per (configuration, term): ResultsStore(results_file).read(terms=[...]) / .wide('p') / .summary(...)
+results_file = './ols_results.sqlite'
 
-first = True
-def dump_results(res, a_n, s_n, a_thres, s_thres):
-  with open('ols_coeffs1.txt', 'a') as fh:
-    fh.write("\na_n:{}, s_n:{}, a_thres:{}, s_thres{}\n".format(a_n, s_n, a_thres, s_thres))
-    fh.write(res.summary().as_text())
-  
-  with open('ols_coeffs1.csv', 'a', newline="") as c:
-    coeffs = res.params.values
-    varnames = np.array([key for key, v in res.params.iteritems()])
+# OLS(...).fit(cov_type='cluster', cov_kwds={'groups': df['course_id']})
+formula = "procrastination_mean_rank ~ C(gender) + C(is_a_urm) + C(first_gen_status) +C(ethnicity)"
 
-    if first:
-      # write header
-      header = np.array(['a_n', 's_n', 'a_thres', 's_thres'])
-      header = np.concatenate((header, varnames))
-      np.savetxt(c, [header], delimiter=',', fmt='%s')
-    
-    hyperparameters = np.array([a_n, s_n, a_thres, s_thres])
-    data = np.concatenate((hyperparameters, coeffs))
-    np.savetxt(c, [data], delimiter=',', fmt='%s')
-  
-  with open('ols_pvalues1.csv', 'a', newline="") as c1:
-    p_values = res.pvalues.round(4).values
-    varnames = np.array([key for key, v in res.pvalues.iteritems()])
+def fit(dataObj):
+  model = smf.ols(formula=formula, data=dataObj.student_course_lvl)
+  return model.fit(cov_type='cluster', cov_kwds={'groups': dataObj.student_course_lvl['course_id']})
 
-    if first:
-      # write header
-      header = np.array(['a_n', 's_n', 'a_thres', 's_thres'])
-      header = np.concatenate((header, varnames))
-      np.savetxt(c1, [header], delimiter=',', fmt='%s')
-    
-    hyperparameters = np.array([a_n, s_n, a_thres, s_thres])
-    data = np.concatenate((hyperparameters, p_values))
-    np.savetxt(c1, [data], delimiter=',', fmt='%s')
+# default grid, 3*4*3*3; values are lists or 'start:stop:step' ranges (stop excluded, as range)
+GRID = {'a_n': '5:30:10', 's_n': '10:50:10', 'a_thres': [0.25, 0.5, 0.75], 's_thres': [0.25, 0.5, 0.75]}
 
-  with open('ols_confint1.csv', 'a', newline="") as c2:
-    ci_errs = res.conf_int()[0] # 95% ci  = res.pvalues.round(4).values
-    varnames = ci_errs.index.values
+def parse_values(values):
+  """
+  values (list, str or number): numbers and 'start:stop:step' ranges, e.g. ['5:30:10', 40] or '0.25:1:0.25'
+  returns list of numbers, ints unless a float is given
+  """
+  if not isinstance(values, (list, tuple)):
+    values = [values]
+  parsed = []
+  for value in values:
+    if isinstance(value, str) and ':' in value:
+      start, stop, step = [float(part) for part in value.split(':')]
+      numbers = np.round(np.arange(start, stop, step), 10).tolist()
+      if all(part.is_integer() for part in (start, stop, step)):
+        numbers = [int(n) for n in numbers]
+      parsed.extend(numbers)
+    elif isinstance(value, str):
+      parsed.append(float(value) if '.' in value else int(value))
+    else:
+      parsed.append(value)
+  return parsed
 
-    if first:
-      # write header
-      header = np.array(['a_n', 's_n', 'a_thres', 's_thres'])
-      header = np.concatenate((header, varnames))
-      np.savetxt(c2, [header], delimiter=',', fmt='%s')
-    
-    hyperparameters = np.array([a_n, s_n, a_thres, s_thres])
-    data = np.concatenate((hyperparameters, ci_errs))
-    np.savetxt(c2, [data], delimiter=',', fmt='%s')
-# OLS(...).fit(cov_type='cluster', cov_kwds={'groups': df['course_id']})
-# 3*4*3*3
-for a_n in range(5,30,10):
-  for s_n in range(10, 50, 10):
-    for a_thres in range(1, 4):
-      a_thres = a_thres/4
-      for s_thres in range(1,4):
-        # testing 0.25, 0.5, 0.75
-        s_thres = s_thres/4
-        dataObj = SubmissionData(columns=columns, file=data_file, full_clean=True, a_n=a_n, s_n=s_n, a_thres=a_thres, s_thres=s_thres)
-        print('executing(a_n:{},s_n{},a_thres:{}, s_thres:{}'.format(a_n, s_n,a_thres,s_thres))
-        model = smf.ols(formula="procrastination_mean_rank ~ C(gender) + C(is_a_urm) + C(first_gen_status) +C(ethnicity)", data=dataObj.student_course_lvl)
-        res = model.fit(cov_type='cluster', cov_kwds={'groups': dataObj.student_course_lvl['course_id']})
-        dump_results(res, a_n, s_n, a_thres, s_thres)
-        print('done')
-        first = False 
+def grid(spec=None):
+  """
+  spec (dict): values per hyperparameter (see parse_values), missing ones come from GRID
+  returns list of (a_n, s_n, a_thres, s_thres), a_n outermost
+  """
+  spec = dict(GRID, **(spec or {}))
+  unknown = set(spec) - set(GRID)
+  if unknown:
+    raise ValueError('unknown hyperparameters: {}'.format(sorted(unknown)))
+  return list(itertools.product(*[parse_values(spec[param]) for param in GRID]))
+
+def read_grid(path):
+  """
+  json file with values per hyperparameter, e.g. {"a_n": "5:30:10", "a_thres": [0.25, 0.5]}
+  """
+  with open(path) as fh:
+    return json.load(fh)
+
+def run(configs=None, workers=1, compact=False, summaries=False, dedupe=True):
+  """
+  fits every configuration not already in results_file, which is the sweep's checkpoint:
+  a killed run is restarted with the same arguments and continues where it stopped
+  (at most the fits buffered since the last write are redone)
+  configs (list): (a_n, s_n, a_thres, s_thres), default grid()
+  dedupe (bool): fit once per distinct surviving data (SubmissionSweep.fingerprint); configurations
+                 with the data of a fitted one store its fit (ResultsStore(results_file).collapsed())
+  """
+  configs = grid() if configs is None else configs
+  with ResultsStore(results_file, summaries=summaries) as store:
+    completed = store.completed()
+    remaining = [config for config in configs if config_key(config) not in completed]
+    print('configurations: {}, already completed: {}'.format(len(configs), len(configs) - len(remaining)))
+    if not remaining:
+      return
+
+    # csv is read and pre-cleaned once; filtered rows are cached per a_thres and (a_thres, s_thres)
+    sweep = SubmissionSweep(columns=columns, file=data_file, cache_dir=cache_dir, compact=compact)
+    fingerprints = {config: sweep.fingerprint(*config) if dedupe else None for config in remaining}
+    stored = store.fingerprints() if dedupe else {}
+    # one configuration fitted per fingerprint not in the store, the others reuse its fit
+    same_data = {}
+    for config in remaining:
+      same_data.setdefault(fingerprints[config] or config, []).append(config)
+    fitted = [group[0] for key, group in same_data.items() if key not in stored]
+    if dedupe:
+      print('distinct datasets: {}, fits: {}'.format(len(same_data), len(fitted)))
+
+    for key, group in same_data.items():
+      if key in stored:
+        for config in group:
+          print('(a_n:{},s_n:{},a_thres:{}, s_thres:{}) has the data of'.format(*config),
+                '(a_n:{},s_n:{},a_thres:{}, s_thres:{})'.format(*stored[key]))
+          store.copy(stored[key], config, key)
+    # results come back in grid order for any number of workers
+    for config, res in zip(fitted, sweep.map(fit, fitted, workers=workers)):
+      a_n, s_n, a_thres, s_thres = config
+      print('executing(a_n:{},s_n{},a_thres:{}, s_thres:{}'.format(a_n, s_n,a_thres,s_thres))
+      for same in same_data[fingerprints[config] or config]:
+        store.add(res, *same, fingerprint=fingerprints[same])
+      print('done')
 
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--workers', type=int, default=1, help='number of processes fitting configurations')
+  parser.add_argument('--compact', action='store_true', help='category/narrow dtypes, per-stage memory usage')
+  parser.add_argument('--summaries', action='store_true', help='also store the statsmodels summary text of every fit')
+  parser.add_argument('--no-dedupe', action='store_true', help='fit every configuration, also those with the same surviving data')
+  parser.add_argument('--grid', help='json file with values per hyperparameter (see read_grid)')
+  for param in GRID:
+    parser.add_argument('--' + param, nargs='+', help="values or 'start:stop:step' ranges, overrides --grid")
+  args = parser.parse_args()
 
+  spec = read_grid(args.grid) if args.grid else {}
+  spec.update({param: getattr(args, param) for param in GRID if getattr(args, param) is not None})
+  # preemption sends SIGTERM: exit through the store's context so buffered fits are written
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+  run(grid(spec), args.workers, args.compact, args.summaries, not args.no_dedupe)
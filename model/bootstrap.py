@@ -0,0 +1,165 @@
+"""
+Course-level (cluster) pairs bootstrap of the ClusterOLS coefficients, without refitting: every
+replicate is a vector of course draw counts, and its normal equations are the weighted sum of
+per-course X'X and X'y, so a chunk of replicates is two matrix products and a batched solve
+"""
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from model.ols import ClusterOLS, OUTCOMES, TERMS
+
+
+class BootstrapResult:
+    """
+    Bootstrap distribution for one outcome
+    params (series): estimates on the data, draws (df): replicate estimates (replicates x terms),
+    bse (series): standard deviation of the draws
+    A replicate missing every course with some level leaves that term's draw nan; a replicate
+    whose design is otherwise singular (e.g. collinear levels in the drawn courses) gets the
+    minimum norm estimates, as ClusterOLS on a rank deficient design (pinv).
+    """
+    def __init__(self, outcome, params, draws):
+        self.outcome = outcome
+        self.params, self.draws = params, draws
+        self.bse = draws.std(ddof=1)
+        self.n_valid = draws.notna().sum()
+
+    def conf_int(self, alpha=0.05, method="percentile"):
+        """
+        method (str): 'percentile' (quantiles of the draws) or 'basic' (quantiles reflected about params)
+        returns df indexed by term with lower (0) and upper (1) bounds, as ClusterOLSResult.conf_int
+        """
+        low = self.draws.quantile(alpha / 2)
+        high = self.draws.quantile(1 - alpha / 2)
+        if method == "basic":
+            low, high = 2 * self.params - high, 2 * self.params - low
+        elif method != "percentile":
+            raise ValueError("method must be 'percentile' or 'basic'")
+        return pd.DataFrame({0: low, 1: high})
+
+
+class ClusterBootstrap:
+    """
+    Pairs bootstrap resampling clusters (courses) with replacement.
+    Per cluster X'X and X'y are computed once; a replicate's estimates solve
+    (sum_g w_g X_g'X_g) b = sum_g w_g X_g'y_g with w the cluster's draw count,
+    the same estimates as OLS on the resampled rows.
+    """
+    def __init__(self, data, terms=TERMS, cluster="course_id", outcomes=OUTCOMES):
+        """
+        data (df): student_course_lvl from SubmissionData
+        terms, cluster: as in ClusterOLS
+        outcomes (list): outcomes bootstrapped together (same draws for all of them)
+        """
+        self.ols = ClusterOLS(data, terms, cluster)
+        self.outcomes = list(outcomes)
+        endog = data[self.outcomes].values.astype(float)
+        valid = self.ols.complete[:, None] & ~np.isnan(endog)
+
+        # clusters are resampled among those with a complete row for some outcome
+        rows = valid.any(axis=1)
+        self.clusters, codes = np.unique(data[cluster].values[rows], return_inverse=True)
+        codes = codes.ravel()
+        exog = self.ols.exog[rows]
+        n_groups, k = len(self.clusters), exog.shape[1]
+
+        # per cluster X'X for every outcome's rows (outcomes with the same missing rows share it)
+        # and X'y: (n_groups, k * k) and (n_groups, k) per outcome, rows of a replicate's sums
+        self.xtx, self.xty = [], []
+        masks = {}
+        for j in range(len(self.outcomes)):
+            mask = valid[rows, j]
+            key = mask.tobytes()
+            if key not in masks:
+                masks[key] = _cluster_gram(exog * mask[:, None], codes, n_groups)
+            self.xtx.append(masks[key])
+            y = np.where(mask, endog[rows, j], 0.0)
+            self.xty.append(_cluster_sums(exog * y[:, None], codes, n_groups))
+
+    def fit(self, replicates=10000, seed=0, workers=1, chunk=500):
+        """
+        replicates (int): bootstrap replicates
+        seed (int): seed of the draws; with the same chunk, results do not depend on workers
+        workers (int): processes solving chunks of replicates
+        chunk (int): replicates per batch (bounds memory to chunk x clusters weights)
+        returns {outcome: BootstrapResult}
+        """
+        sizes = [min(chunk, replicates - start) for start in range(0, replicates, chunk)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        tasks = list(zip(sizes, seeds))
+        if workers <= 1:
+            _init_worker(self.xtx, self.xty)
+            draws = list(map(_solve_chunk, tasks))
+        else:
+            with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(self.xtx, self.xty)) as pool:
+                draws = pool.map(_solve_chunk, tasks)
+        draws = np.concatenate(draws, axis=1)  # (outcomes, replicates, k)
+
+        fitted = self.ols.fit(self.outcomes)
+        results = {}
+        for j, outcome in enumerate(self.outcomes):
+            results[outcome] = BootstrapResult(
+                outcome, fitted[outcome].params, pd.DataFrame(draws[j], columns=self.ols.names)
+            )
+        return results
+
+
+def _cluster_sums(values, codes, n_groups):
+    """
+    values (n, p), codes (n,) in [0, n_groups): returns per cluster column sums (n_groups, p)
+    """
+    return np.column_stack([np.bincount(codes, weights=values[:, i], minlength=n_groups) for i in range(values.shape[1])])
+
+
+def _cluster_gram(exog, codes, n_groups):
+    """
+    returns per cluster X_g'X_g flattened (n_groups, k * k), one bincount per column pair
+    """
+    k = exog.shape[1]
+    gram = np.empty((n_groups, k, k))
+    for i in range(k):
+        for j in range(i, k):
+            gram[:, i, j] = gram[:, j, i] = np.bincount(codes, weights=exog[:, i] * exog[:, j], minlength=n_groups)
+    return gram.reshape(n_groups, k * k)
+
+
+_state = {}  # per process cluster sums (see _init_worker)
+
+
+def _init_worker(xtx, xty):
+    _state["xtx"], _state["xty"] = xtx, xty
+
+
+def _solve_chunk(task):
+    """
+    returns estimates (outcomes, size, k) of size replicates drawn with seed
+    """
+    size, seed = task
+    xtx, xty = _state["xtx"], _state["xty"]
+    n_groups, k = xty[0].shape
+    rng = np.random.default_rng(seed)
+    weights = rng.multinomial(n_groups, np.full(n_groups, 1.0 / n_groups), size=size).astype(float)
+
+    draws = np.empty((len(xty), size, k))
+    solved = {}
+    for j in range(len(xty)):
+        key = id(xtx[j])
+        if key not in solved:
+            a = (weights @ xtx[j]).reshape(size, k, k)
+            # a level with no rows in the replicate (every course with it left out) is unidentified
+            missing = np.diagonal(a, axis1=1, axis2=2) == 0
+            a = a + np.einsum("rk,kl->rkl", missing, np.eye(k))  # unit pivot, its estimate is set nan below
+            # a replicate drawing only courses where some levels are collinear is singular, whether or not
+            # its LU pivots come out exactly zero: it gets the minimum norm estimates, as ClusterOLS (pinv)
+            singular = np.linalg.matrix_rank(a, hermitian=True) < k
+            solved[key] = a, missing, singular
+        a, missing, singular = solved[key]
+        b = weights @ xty[j]
+        draws[j][~singular] = np.linalg.solve(a[~singular], b[~singular][:, :, None])[:, :, 0]
+        if singular.any():
+            rcond = k * np.finfo(float).eps  # matrix_rank's tolerance
+            draws[j][singular] = (np.linalg.pinv(a[singular], rcond, hermitian=True) @ b[singular][:, :, None])[:, :, 0]
+        draws[j][missing] = np.nan
+    return draws
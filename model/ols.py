@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# procrastination_mean_rank ~ C(gender) + C(is_a_urm) + C(first_gen_status) + C(ethnicity)
+TERMS = ["gender", "is_a_urm", "first_gen_status", "ethnicity"]
+OUTCOMES = [
+    "procrastination_mean_rank",
+    "procrastination_median_rank",
+    "procrastination_std_rank",
+    "final_score_percentile_ranks",
+]
+
+
+class ClusterOLSResult:
+    """
+    Estimates for one outcome, with the statsmodels names used by dump_results
+    params, bse, tvalues, pvalues (series indexed by term)
+    """
+    def __init__(self, outcome, params, bse, nobs, n_groups):
+        self.outcome = outcome
+        self.params, self.bse = params, bse
+        self.nobs, self.n_groups = nobs, n_groups
+        self.tvalues = params / bse
+        # cluster covariance without use_t: normal reference distribution, as statsmodels
+        self.pvalues = pd.Series(2 * stats.norm.sf(np.abs(self.tvalues.values)), index=params.index)
+
+    def conf_int(self, alpha=0.05):
+        q = stats.norm.ppf(1 - alpha / 2)
+        return pd.DataFrame({0: self.params - q * self.bse, 1: self.params + q * self.bse})
+
+
+class ClusterOLS:
+    """
+    OLS with treatment coded categorical terms and cluster robust (CRV1) standard errors,
+    matching smf.ols(formula).fit(cov_type='cluster', cov_kwds={'groups': ...}).
+    The design is built once; outcomes are solved together.
+    """
+    def __init__(self, data, terms=TERMS, cluster="course_id"):
+        """
+        data (df): student_course_lvl from SubmissionData
+        terms (list): categorical columns, first level is the reference (C(term) in patsy)
+        cluster (str): column with cluster ids
+        """
+        self.data, self.cluster = data, cluster
+        columns, names = [np.ones(len(data))], ["Intercept"]
+        complete = np.ones(len(data), dtype=bool)
+        for term in terms:
+            values = data[term]
+            complete &= values.notna().values
+            for level in self._levels(values)[1:]:
+                columns.append((values == level).values.astype(float))
+                names.append("C({})[T.{}]".format(term, level))
+
+        self.exog = np.column_stack(columns)
+        self.names = names
+        self.complete = complete  # rows with every term present (patsy drops the rest)
+
+    def _levels(self, values):
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return list(values.cat.categories)
+        return sorted(values.dropna().unique())
+
+    def fit(self, outcomes=OUTCOMES):
+        """
+        returns {outcome: ClusterOLSResult}
+        outcomes missing on the same rows are solved in one batch
+        """
+        endog = self.data[outcomes].values.astype(float)
+        masks = {}
+        for j, outcome in enumerate(outcomes):
+            mask = self.complete & ~np.isnan(endog[:, j])
+            masks.setdefault(mask.tobytes(), (mask, []))[1].append(j)
+
+        results = {}
+        for mask, idx in masks.values():
+            params, bse, n_groups = self._fit_batch(self.exog[mask], endog[mask][:, idx], self.data[self.cluster].values[mask])
+            for col, j in enumerate(idx):
+                results[outcomes[j]] = ClusterOLSResult(
+                    outcomes[j],
+                    pd.Series(params[:, col], index=self.names),
+                    pd.Series(bse[:, col], index=self.names),
+                    int(mask.sum()),
+                    n_groups,
+                )
+        return {outcome: results[outcome] for outcome in outcomes}
+
+    def _fit_batch(self, exog, endog, groups):
+        """
+        exog (n, k), endog (n, m), groups (n,)
+        returns params (k, m), bse (k, m), number of clusters
+        """
+        nobs, k = exog.shape
+        pinv = np.linalg.pinv(exog)
+        params = pinv @ endog
+        resid = endog - exog @ params
+        bread = pinv @ pinv.T  # (X'X)^-1
+
+        # per cluster scores X_g' u_g for every outcome: (n_groups, k, m)
+        _, codes = np.unique(groups, return_inverse=True)
+        order = np.argsort(codes, kind="stable")
+        starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+        scores = exog[order][:, :, None] * resid[order][:, None, :]
+        cluster_scores = np.add.reduceat(scores, starts, axis=0)
+        n_groups = len(starts)
+
+        meat = np.einsum("gkm,glm->mkl", cluster_scores, cluster_scores)
+        cov = bread[None] @ meat @ bread[None]
+        cov *= n_groups / (n_groups - 1.0) * ((nobs - 1.0) / (nobs - k))
+        bse = np.sqrt(np.diagonal(cov, axis1=1, axis2=2)).T
+        return params, bse, n_groups
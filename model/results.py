@@ -0,0 +1,251 @@
+import sqlite3
+
+import pandas as pd
+
+PARAMS = ["a_n", "s_n", "a_thres", "s_thres"]
+FIELDS = ["coef", "se", "p", "ci_low", "ci_high", "n_obs"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+  a_n INTEGER NOT NULL,
+  s_n INTEGER NOT NULL,
+  a_thres REAL NOT NULL,
+  s_thres REAL NOT NULL,
+  outcome TEXT NOT NULL,
+  term TEXT NOT NULL,
+  coef REAL,
+  se REAL,
+  p REAL,
+  ci_low REAL,
+  ci_high REAL,
+  n_obs INTEGER,
+  PRIMARY KEY (a_n, s_n, a_thres, s_thres, outcome, term)
+);
+CREATE INDEX IF NOT EXISTS results_term ON results (term, outcome);
+CREATE TABLE IF NOT EXISTS configs (
+  a_n INTEGER NOT NULL,
+  s_n INTEGER NOT NULL,
+  a_thres REAL NOT NULL,
+  s_thres REAL NOT NULL,
+  PRIMARY KEY (a_n, s_n, a_thres, s_thres)
+);
+CREATE TABLE IF NOT EXISTS summaries (
+  a_n INTEGER NOT NULL,
+  s_n INTEGER NOT NULL,
+  a_thres REAL NOT NULL,
+  s_thres REAL NOT NULL,
+  outcome TEXT NOT NULL,
+  text TEXT,
+  PRIMARY KEY (a_n, s_n, a_thres, s_thres, outcome)
+);
+CREATE TABLE IF NOT EXISTS fingerprints (
+  a_n INTEGER NOT NULL,
+  s_n INTEGER NOT NULL,
+  a_thres REAL NOT NULL,
+  s_thres REAL NOT NULL,
+  fingerprint TEXT NOT NULL,
+  PRIMARY KEY (a_n, s_n, a_thres, s_thres)
+);
+CREATE INDEX IF NOT EXISTS fingerprints_fingerprint ON fingerprints (fingerprint);
+"""
+
+
+class ResultsStore:
+    """
+    Long-form store of sweep fits in one sqlite file: a row per
+    (a_n, s_n, a_thres, s_thres, outcome, term) with coef, se, p, ci_low, ci_high, n_obs.
+    Rows are buffered and written batch_size fits at a time; several processes can write
+    to the same file (WAL journal, writers wait on each other's transactions).
+    Each configuration is recorded as completed in the same transaction as its rows, so the
+    store doubles as the checkpoint of a sweep (see completed). With the fingerprint of its
+    surviving data (SubmissionSweep.fingerprint), configurations fitting the same data are
+    recorded together (see fingerprints, collapsed).
+    """
+    def __init__(self, path, batch_size=20, summaries=False, timeout=60):
+        """
+        path (str): sqlite file (created if missing)
+        batch_size (int): fits buffered before a write
+        summaries (bool): also keep res.summary().as_text() per fit (statsmodels results only),
+                          rendered when the batch is written
+        timeout (float): seconds to wait for another writer's lock
+        """
+        self.path, self.batch_size, self.summaries = path, batch_size, summaries
+        self.conn = sqlite3.connect(path, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self._rows, self._pending, self._summaries, self._fingerprints = [], [], [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, res, a_n, s_n, a_thres, s_thres, fingerprint=None):
+        """
+        buffers the fit of a configuration
+        res: fitted result (statsmodels or model.ols.ClusterOLSResult), or dict of them by outcome
+        fingerprint (str): digest of the configuration's surviving data, if known
+        """
+        config = config_key((a_n, s_n, a_thres, s_thres))
+        for res in (res.values() if isinstance(res, dict) else [res]):
+            outcome = getattr(res, "outcome", None) or res.model.endog_names
+            ci = res.conf_int()
+            key = config + (outcome,)
+            for term in res.params.index:
+                self._rows.append(key + (
+                    term,
+                    float(res.params[term]),
+                    float(res.bse[term]),
+                    float(res.pvalues[term]),
+                    float(ci.loc[term, 0]),
+                    float(ci.loc[term, 1]),
+                    int(res.nobs),
+                ))
+            if self.summaries:
+                # keep the result, the text is only rendered when the batch is written
+                self._summaries.append((key, res))
+        self._finish(config, fingerprint)
+
+    def copy(self, source, config, fingerprint=None):
+        """
+        buffers the stored fit of source (a completed configuration) as the fit of config,
+        e.g. a configuration with the same fingerprint, without fitting it again
+        """
+        source, config = config_key(source), config_key(config)
+        self.flush()
+        where = "WHERE a_n = ? AND s_n = ? AND a_thres = ? AND s_thres = ?"
+        rows = self.conn.execute("SELECT * FROM results {} ORDER BY rowid".format(where), source).fetchall()
+        texts = self.conn.execute("SELECT outcome, text FROM summaries {}".format(where), source).fetchall()
+        self._rows.extend(config + row[4:] for row in rows)
+        self._summaries.extend((config + (outcome,), text) for outcome, text in texts)
+        self._finish(config, fingerprint)
+
+    def _finish(self, config, fingerprint):
+        self._pending.append(config)
+        if fingerprint is not None:
+            self._fingerprints.append(config + (fingerprint,))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        writes buffered fits in one transaction; a configuration written again replaces its rows
+        """
+        if not self._pending:
+            return
+        summaries = [key + (res if isinstance(res, str) else res.summary().as_text(),) for key, res in self._summaries]
+        with self.conn:
+            for table in ["results", "summaries", "fingerprints"]:
+                self.conn.executemany(
+                    "DELETE FROM {} WHERE a_n = ? AND s_n = ? AND a_thres = ? AND s_thres = ?".format(table), self._pending
+                )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results VALUES ({})".format(", ".join("?" * 12)), self._rows
+            )
+            if summaries:
+                self.conn.executemany("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?, ?)", summaries)
+            self.conn.executemany("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?)", self._fingerprints)
+            self.conn.executemany("INSERT OR REPLACE INTO configs VALUES (?, ?, ?, ?)", self._pending)
+        self._rows, self._pending, self._summaries, self._fingerprints = [], [], [], []
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def completed(self):
+        """
+        returns set of (a_n, s_n, a_thres, s_thres) configurations written to the store
+        """
+        self.flush()
+        return set(self.conn.execute("SELECT a_n, s_n, a_thres, s_thres FROM configs").fetchall())
+
+    def fingerprints(self):
+        """
+        returns {fingerprint: (a_n, s_n, a_thres, s_thres)} of completed configurations, the first
+        one written for each fingerprint
+        """
+        self.flush()
+        rows = self.conn.execute(
+            "SELECT fingerprint, a_n, s_n, a_thres, s_thres FROM fingerprints ORDER BY rowid DESC"
+        ).fetchall()
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def collapsed(self):
+        """
+        returns df of the configurations sharing their fingerprint with another one: params,
+        fingerprint and group (number of the set of configurations fitting the same data)
+        """
+        self.flush()
+        data = pd.read_sql_query(
+            "SELECT * FROM fingerprints WHERE fingerprint IN "
+            "(SELECT fingerprint FROM fingerprints GROUP BY fingerprint HAVING COUNT(*) > 1) "
+            "ORDER BY a_n, s_n, a_thres, s_thres", self.conn
+        )
+        data["group"] = pd.factorize(data["fingerprint"])[0]
+        return data
+
+    def read(self, terms=None, outcome=None, **params):
+        """
+        returns long-form df of stored rows, filtered in sqlite
+        terms (list): terms to keep, e.g. ['C(gender)[T.M]']
+        outcome (str): dependent variable to keep
+        params: equality filters on a_n, s_n, a_thres, s_thres
+        """
+        where, args = [], []
+        for param, value in params.items():
+            if param not in PARAMS:
+                raise ValueError("unknown parameter: {}".format(param))
+            where.append("{} = ?".format(param))
+            args.append(value)
+        if outcome is not None:
+            where.append("outcome = ?")
+            args.append(outcome)
+        if terms is not None:
+            where.append("term IN ({})".format(", ".join("?" * len(terms))))
+            args.extend(terms)
+
+        self.flush()
+        query = "SELECT * FROM results"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        return pd.read_sql_query(query + " ORDER BY a_n, s_n, a_thres, s_thres, outcome, rowid", self.conn, params=args)
+
+    def wide(self, field="coef", **filters):
+        """
+        returns one row per configuration and a column per term (the old ols_*.csv layout)
+        field (str): one of coef, se, p, ci_low, ci_high, n_obs
+        """
+        if field not in FIELDS:
+            raise ValueError("unknown field: {}".format(field))
+        data = self.read(**filters)
+        terms = list(dict.fromkeys(data["term"]))
+        return data.pivot(index=PARAMS + ["outcome"], columns="term", values=field)[terms].reset_index()
+
+    def summary(self, a_n, s_n, a_thres, s_thres):
+        """
+        returns text for a configuration: the stored statsmodels summaries if they were kept,
+        otherwise a coefficient table rendered from the stored rows
+        """
+        key = config_key((a_n, s_n, a_thres, s_thres))
+        self.flush()
+        stored = self.conn.execute(
+            "SELECT text FROM summaries WHERE a_n = ? AND s_n = ? AND a_thres = ? AND s_thres = ? ORDER BY outcome", key
+        ).fetchall()
+        if stored:
+            return "\n".join(row[0] for row in stored)
+
+        data = self.read(**dict(zip(PARAMS, key)))
+        lines = ["a_n:{}, s_n:{}, a_thres:{}, s_thres:{}".format(*key)]
+        for outcome, rows in data.groupby("outcome", sort=False):
+            lines.append("{} (n_obs: {})".format(outcome, rows["n_obs"].iloc[0]))
+            lines.append(rows.set_index("term")[["coef", "se", "p", "ci_low", "ci_high"]].to_string(float_format="{:.4f}".format))
+        return "\n".join(lines)
+
+
+def config_key(config):
+    """
+    (a_n, s_n, a_thres, s_thres) with the types stored in sqlite, for comparing with completed()
+    """
+    a_n, s_n, a_thres, s_thres = config
+    return int(a_n), int(s_n), float(a_thres), float(s_thres)
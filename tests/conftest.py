@@ -0,0 +1,44 @@
+"""
+Shared fixtures: small synthetic submission frames (clean.synthetic) with missing keys, and
+SubmissionData built over them
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# modules are imported from the repository root, as the scripts run them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clean.clean_data import SubmissionData  # noqa: E402
+from clean.instrument import Instrumentation  # noqa: E402
+from clean.synthetic import MISSING, synthetic_submissions  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def submissions():
+    """
+    about 6000 submissions; some course, user and assignment ids, scores and times are missing
+    """
+    data = synthetic_submissions(6000, enrollment=30, assignments=12, missing=dict(MISSING, user_id=0.005, submitted_at=0.005),
+                                 seed=7)
+    rng = np.random.default_rng(7)
+    for col in ["course_id", "assignment_id"]:
+        data.loc[rng.random(len(data)) < 0.005, col] = np.nan
+    return data
+
+
+@pytest.fixture(scope="session")
+def submission_data():
+    """
+    returns make(data, stages=(), full_clean=False, counts=True, **params): a quiet SubmissionData
+    over a copy of data with the named stages run, e.g. make(submissions, ["datetime_conversions"], a_thres=0.25)
+    """
+    def make(data, stages=(), full_clean=False, counts=True, **params):
+        obj = SubmissionData(columns=list(data.columns), file=None, data=data.copy(), full_clean=full_clean,
+                             instrument=Instrumentation(counts=counts, verbose=False), **params)
+        if stages:
+            obj._run_stages([getattr(obj, stage) for stage in stages])
+        return obj
+    return make
@@ -0,0 +1,42 @@
+"""
+SubmissionData with backend='duckdb' against the pandas stages
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from db.queries import filtered_submissions_query
+
+duckdb = pytest.importorskip("duckdb")
+
+CONFIGS = [dict(a_n=2, s_n=5), dict(a_n=5, s_n=10, a_thres=0.25, s_thres=0.75)]
+
+
+@pytest.fixture(scope="module")
+def exported(submissions):
+    """
+    filtered_submissions_query export of the fixture, with some users and assignments missing
+    """
+    con = duckdb.connect()
+    con.register("submissions", submissions)
+    data = con.execute(filtered_submissions_query(list(submissions.columns), a_n=0, s_n=0)).fetchdf()
+    con.close()
+    rng = np.random.default_rng(5)
+    for col in ["user_id", "assignment_id"]:
+        data.loc[rng.random(len(data)) < 0.01, col] = np.nan
+    return data
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+@pytest.mark.parametrize("kind", ["plain", "compact", "filtered"])
+def test_duckdb_matches_pandas(submissions, exported, submission_data, kind, config):
+    data = exported if kind == "filtered" else submissions
+    params = dict(config, compact=kind == "compact", filtered=kind == "filtered")
+    expected = submission_data(data, full_clean=True, **params)
+    result = submission_data(data, full_clean=True, backend="duckdb", **params)
+    assert len(expected.student_course_lvl)
+    # filtered exports are not filtered again: rows with a missing user or assignment are kept
+    assert kind != "filtered" or expected.data[["user_id", "assignment_id"]].isna().any().all()
+    for frame in ["data", "student_course_lvl"]:
+        pd.testing.assert_frame_equal(getattr(result, frame), getattr(expected, frame), check_exact=False,
+                                      rtol=1e-12, atol=1e-12)
@@ -0,0 +1,60 @@
+"""
+ClusterBootstrap replicates against least squares on the resampled rows
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from model import bootstrap
+from model.bootstrap import ClusterBootstrap
+from model.ols import OUTCOMES
+
+
+@pytest.fixture(scope="module")
+def collinear():
+    # in courses 0-3 gender M is urm Y, so replicates drawing only those courses are singular
+    rng = np.random.default_rng(3)
+    rows = []
+    for course in range(6):
+        for _ in range(40):
+            gender = rng.choice(["F", "M"])
+            urm = ("Y" if gender == "M" else "N") if course < 4 else rng.choice(["N", "Y"])
+            row = dict(course_id=course, gender=gender, is_a_urm=urm,
+                       first_gen_status=rng.choice(["N", "Y"]), ethnicity=rng.choice(["a", "b", "c"]))
+            row.update({outcome: rng.normal() for outcome in OUTCOMES})
+            rows.append(row)
+    data = pd.DataFrame(rows)
+    data.loc[rng.random(len(data)) < 0.05, "procrastination_std_rank"] = np.nan
+    return data
+
+
+def test_replicates_match_least_squares(collinear):
+    boot = ClusterBootstrap(collinear)
+    size, seed = 300, np.random.SeedSequence(1)
+    bootstrap._init_worker(boot.xtx, boot.xty)
+    draws = bootstrap._solve_chunk((size, seed))
+    # the draws of _solve_chunk
+    n_groups = len(boot.clusters)
+    weights = np.random.default_rng(seed).multinomial(n_groups, np.full(n_groups, 1.0 / n_groups), size=size)
+
+    codes = np.searchsorted(boot.clusters, collinear["course_id"].values)
+    singular = 0
+    for r in range(size):
+        rows = np.repeat(np.arange(len(collinear)), weights[r][codes])
+        exog = boot.ols.exog[rows]
+        singular += np.linalg.matrix_rank(exog) < exog.shape[1] - (exog == 0).all(axis=0).sum()
+        for j, outcome in enumerate(OUTCOMES):
+            y = collinear[outcome].values[rows]
+            keep = boot.ols.complete[rows] & ~np.isnan(y)
+            expected = np.linalg.pinv(exog[keep]) @ y[keep]
+            missing = np.isnan(draws[j, r])
+            assert (missing == (exog[keep] == 0).all(axis=0)).all()
+            np.testing.assert_allclose(draws[j, r][~missing], expected[~missing], rtol=1e-7, atol=1e-9)
+    assert singular > 0
+
+
+def test_fit_with_singular_replicates(collinear):
+    results = ClusterBootstrap(collinear).fit(2000, chunk=500)
+    for result in results.values():
+        assert np.isfinite(result.bse).all()
+        assert (result.n_valid > 0).all()
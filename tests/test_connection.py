@@ -0,0 +1,100 @@
+"""
+Client.key_partitions on a stub cursor, and query_to_csv_partitioned against a PostgreSQL
+given by TEST_POSTGRES_DSN (a libpq connection string; skipped without it)
+"""
+import json
+import os
+
+import pandas as pd
+import pytest
+
+connection = pytest.importorskip("db.connection")  # needs psycopg2, sshtunnel and private.private
+
+
+class StubCursor:
+    def __init__(self, keys):
+        self.keys, self.queries = keys, []
+
+    def execute(self, query):
+        self.queries.append(query)
+
+    def fetchall(self):
+        # postgres sorts nulls last
+        return [(key,) for key in sorted(self.keys, key=lambda key: (key is None, key))]
+
+    def close(self):
+        pass
+
+
+class StubConnection:
+    def __init__(self, keys):
+        self.keys = keys
+
+    def cursor(self):
+        return StubCursor(self.keys)
+
+
+def stub_client(keys):
+    client = connection.Client.__new__(connection.Client)
+    client.server, client.conn_kwargs, client.conn = None, {}, StubConnection(keys)
+    return client
+
+
+@pytest.mark.parametrize("keys, n_partitions, expected", [
+    (list(range(1, 11)), 3, [(1, 4), (5, 8), (9, 10)]),
+    (list(range(1, 9)), 4, [(1, 2), (3, 4), (5, 6), (7, 8)]),
+    ([3, 7, 9], 8, [(3, 3), (7, 7), (9, 9)]),  # fewer keys than partitions
+    ([5], 4, [(5, 5)]),
+    ([5, None], 4, [(5, 5), None]),
+    ([None, 2, 1], 1, [(1, 2), None]),
+    ([None], 4, [None]),
+    ([], 4, []),
+])
+def test_key_partitions(keys, n_partitions, expected):
+    partitions = stub_client(keys).key_partitions("SELECT * FROM submissions", n_partitions=n_partitions)
+    assert partitions == expected
+    # every key in exactly one range
+    for key in keys:
+        covering = [p for p in partitions if (p is None if key is None else p is not None and p[0] <= key <= p[1])]
+        assert len(covering) == 1, key
+
+
+@pytest.fixture
+def postgres():
+    dsn = os.environ.get("TEST_POSTGRES_DSN")
+    if not dsn:
+        pytest.skip("TEST_POSTGRES_DSN not set")
+    client = connection.Client.local(dsn=dsn)
+    table = "test_partitions_{}".format(os.getpid())
+    cur = client.conn.cursor()
+    # keys with several rows each, a gap, and null keys
+    cur.execute("CREATE TABLE {} AS SELECT CASE WHEN i % 17 = 0 THEN NULL ELSE (i % 13) * 10 END AS course_id, "
+                "i AS id FROM generate_series(1, 500) i".format(table))
+    client.conn.commit()
+    yield client, table
+    cur = client.conn.cursor()
+    cur.execute("DROP TABLE {}".format(table))
+    client.conn.commit()
+    client.close_connection()
+
+
+@pytest.mark.parametrize("n_partitions", [1, 4, 20])
+def test_partitioned_export_covers_rows_once(postgres, tmp_path, n_partitions):
+    client, table = postgres
+    query = "SELECT * FROM {}".format(table)
+    manifest = client.query_to_csv_partitioned(query, str(tmp_path), n_partitions=n_partitions, workers=3)
+
+    parts = [pd.read_csv(tmp_path / part["file"]) for part in manifest["partitions"]]
+    for part, rows in zip(manifest["partitions"], parts):
+        # manifest counts are the rows copied (cur.rowcount after copy_expert)
+        assert part["rows"] == len(rows) > 0
+        if part["null_key"]:
+            assert rows["course_id"].isna().all()
+        else:
+            assert rows["course_id"].between(part["low"], part["high"]).all()
+    exported = pd.concat(parts, ignore_index=True)
+    expected = client.query_to_df(query)
+    assert sorted(exported["id"]) == sorted(expected["id"])
+    assert sum(part["null_key"] for part in manifest["partitions"]) == 1
+    with open(tmp_path / "manifest.json") as f:
+        assert json.load(f)["partitions"] == json.loads(json.dumps(manifest["partitions"], default=str))
@@ -0,0 +1,67 @@
+"""
+Vectorized SubmissionData filters and invariants against the groupby().filter versions they replaced
+"""
+import math
+
+import pandas as pd
+import pytest
+
+CONFIGS = [dict(a_thres=0.5, s_thres=0.5), dict(a_thres=0.25, s_thres=0.75), dict(a_thres=0.75, s_thres=0.25)]
+
+
+def course_filter(data):
+    return data.groupby("course_id").filter(lambda df: df.head(1)["course_mean"].values[0] != 0)
+
+
+def assignment_filter(data, a_thres):
+    return data.groupby("assignment_id").filter(
+        lambda df: (df["user_id"].nunique() / df.head(1)["course_size"].values[0]) > a_thres
+    )
+
+
+def student_filter(data, s_thres):
+    n_assignments = data.groupby("course_id")["assignment_id"].nunique()
+    data = data.merge(n_assignments, on=["course_id"], how="left")
+    data = data.rename(columns={"assignment_id_x": "assignment_id", "assignment_id_y": "n_assignments"})
+    return data.groupby(["user_id", "course_id"]).filter(
+        lambda df: df["assignment_id"].nunique() > math.floor(df["n_assignments"].iloc[0] * s_thres)
+    )
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+def test_filters_match_groupby_filter(submissions, submission_data, config):
+    obj = submission_data(submissions, ["datetime_conversions", "aggegate_class_stats_join"], **config)
+    expected = obj.data.copy()
+    assert expected[["course_id", "user_id", "assignment_id"]].isna().any().all()
+
+    obj._run_stages([obj.course_filter, obj.assignment_filter, obj.student_filter])
+    expected = student_filter(assignment_filter(course_filter(expected), config["a_thres"]), config["s_thres"])
+    assert len(expected)
+    pd.testing.assert_frame_equal(obj.data.reset_index(drop=True), expected.reset_index(drop=True))
+
+
+def validate_n_stud_assign(data, a_n, s_n):
+    n_assignments = data.groupby("course_id")["assignment_id"].nunique()
+    n_students = data.groupby("course_id")["user_id"].nunique()
+    data = data.merge(n_assignments, on=["course_id"], how="left")
+    data = data.rename(columns={"assignment_id_x": "assignment_id", "assignment_id_y": "n_assignments_updated"})
+    data = data.merge(n_students, on=["course_id"], how="left")
+    data = data.rename(columns={"user_id_x": "user_id", "user_id_y": "n_students_updated"})
+    data = data.groupby("course_id").filter(lambda df: df.head(1)["n_students_updated"].values[0] > s_n)
+    return data.groupby("course_id").filter(lambda df: df.head(1)["n_assignments_updated"].values[0] > a_n)
+
+
+@pytest.mark.parametrize("filtered", [False, True])
+@pytest.mark.parametrize("config", [dict(a_n=5, s_n=20), dict(a_n=10, s_n=24), dict(a_n=11, s_n=10)])
+def test_invariants_match_groupby_filter(submissions, submission_data, config, filtered):
+    # on the joined data (missing keys) and on the filtered rows the invariants usually see
+    stages = ["datetime_conversions", "aggegate_class_stats_join"]
+    obj = submission_data(submissions, stages + (["course_filter", "assignment_filter", "student_filter"] if filtered else []),
+                          **config)
+    joined = obj.data.copy()
+    assert filtered or joined[["course_id", "user_id", "assignment_id"]].isna().any().all()
+
+    obj._run_stages([obj.validate_n_stud_assign])
+    expected = validate_n_stud_assign(joined, **config)
+    assert 0 < len(expected) < joined["course_id"].notna().sum()
+    pd.testing.assert_frame_equal(obj.data.reset_index(drop=True), expected.reset_index(drop=True))
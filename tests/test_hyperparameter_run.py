@@ -0,0 +1,39 @@
+"""
+hyperparameter_run.run with fingerprint dedupe against fitting every configuration
+"""
+import pandas as pd
+import pytest
+
+import hyperparameter_run
+from clean.synthetic import synthetic_submissions
+from model.results import ResultsStore
+
+CONFIGS = hyperparameter_run.grid({"a_n": [2, 8, 11], "s_n": [5, 25], "a_thres": [0.25, 0.5], "s_thres": [0.5]})
+
+
+@pytest.fixture(scope="module")
+def data_file(tmp_path_factory):
+    # no missing demographics: fit passes the course ids of every row as cluster groups
+    data = synthetic_submissions(6000, enrollment=30, assignments=12, missing={}, seed=7)
+    path = tmp_path_factory.mktemp("data") / "submissions.csv"
+    data.to_csv(path, index=False)
+    return str(path)
+
+
+def test_dedupe_stores_same_rows(data_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(hyperparameter_run, "data_file", data_file)
+    monkeypatch.setattr(hyperparameter_run, "cache_dir", None)
+    stored = {}
+    for dedupe in [False, True]:
+        path = str(tmp_path / "results_{}.sqlite".format(dedupe))
+        monkeypatch.setattr(hyperparameter_run, "results_file", path)
+        if dedupe:
+            # a first run, so the second one also reuses fits stored by it
+            hyperparameter_run.run(CONFIGS[::2], dedupe=True)
+        hyperparameter_run.run(CONFIGS, dedupe=dedupe)
+        with ResultsStore(path) as store:
+            stored[dedupe] = store.read()
+            if dedupe:
+                assert len(store.collapsed())
+    assert len(stored[False])
+    pd.testing.assert_frame_equal(stored[True], stored[False])
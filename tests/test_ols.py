@@ -0,0 +1,30 @@
+"""
+ClusterOLS against statsmodels formula fits with cluster covariance
+"""
+import numpy as np
+import pytest
+import statsmodels.formula.api as smf
+
+from model.ols import ClusterOLS, OUTCOMES, TERMS
+
+
+@pytest.fixture(scope="module")
+def student_course_lvl(submissions, submission_data):
+    return submission_data(submissions, full_clean=True, a_n=2, s_n=5).student_course_lvl
+
+
+def test_matches_statsmodels(student_course_lvl):
+    results = ClusterOLS(student_course_lvl).fit(OUTCOMES)
+    for outcome in OUTCOMES:
+        # patsy drops incomplete rows, the cluster groups have to be dropped with them
+        data = student_course_lvl.dropna(subset=TERMS + [outcome])
+        expected = smf.ols("{} ~ {}".format(outcome, " + ".join("C({})".format(term) for term in TERMS)), data=data).fit(
+            cov_type="cluster", cov_kwds={"groups": data["course_id"]}
+        )
+        result = results[outcome]
+        assert result.nobs == expected.nobs
+        assert list(result.params.index) == list(expected.params.index)
+        np.testing.assert_allclose(result.params, expected.params, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(result.bse, expected.bse, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(result.pvalues, expected.pvalues, rtol=1e-6, atol=1e-10)
+        np.testing.assert_allclose(result.conf_int(), expected.conf_int(), rtol=1e-8, atol=1e-10)
@@ -0,0 +1,39 @@
+"""
+filtered_submissions_query on DuckDB against the SubmissionData filters
+"""
+import pandas as pd
+import pytest
+
+from db.queries import FILTER_COLUMNS, filtered_submissions_query
+
+duckdb = pytest.importorskip("duckdb")
+
+CONFIGS = [dict(a_n=2, s_n=5, a_thres=0.5, s_thres=0.5), dict(a_n=5, s_n=10, a_thres=0.25, s_thres=0.75)]
+KEYS = ["course_id", "user_id", "assignment_id"]
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+def test_query_matches_pandas_filters(submissions, submission_data, config):
+    columns = list(submissions.columns)
+    con = duckdb.connect()
+    con.register("submissions", submissions)
+    exported = con.execute(filtered_submissions_query(columns, **config)).fetchdf()
+    con.close()
+
+    # surviving rows and the filter columns (the other columns are transformed by the stages)
+    expected = submission_data(submissions, full_clean=True, **config)
+    compared = KEYS + ["final_score"] + FILTER_COLUMNS
+    rows = expected.data[compared].sort_values(KEYS).reset_index(drop=True)
+    assert len(rows)
+    pd.testing.assert_frame_equal(exported[compared].sort_values(KEYS).reset_index(drop=True), rows, check_dtype=False)
+
+    # the export cleaned with filtered=True gives the same student-course frame (group_by_students
+    # keeps a student's first row, so the export is put back in the order of the source rows)
+    order = pd.Series(range(len(submissions)), index=pd.MultiIndex.from_frame(submissions[KEYS]))
+    exported = exported.iloc[order[pd.MultiIndex.from_frame(exported[KEYS])].argsort()].reset_index(drop=True)
+    filtered = submission_data(exported, full_clean=True, filtered=True, **config)
+    pd.testing.assert_frame_equal(
+        filtered.student_course_lvl.sort_values(KEYS[:2]).reset_index(drop=True),
+        expected.student_course_lvl.sort_values(KEYS[:2]).reset_index(drop=True),
+        check_dtype=False,
+    )
@@ -0,0 +1,94 @@
+"""
+RankIndex updates against add_ranks recomputed on the updated frame
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from clean.ranks import KEY_COLUMNS, STAT_COLUMNS, RankIndex
+
+
+@pytest.fixture(scope="module")
+def add_ranks(submission_data):
+    return lambda data: submission_data(data, ["add_ranks"], counts=False).data
+
+
+def assert_matches(index, expected):
+    result = index.to_frame()
+    merged = expected.merge(result, on=KEY_COLUMNS, suffixes=("", "_index"), validate="1:1")
+    assert len(merged) == len(expected) == len(result)
+    for col in ["assignment_ranks", "assignment_percentile_ranks"] + STAT_COLUMNS:
+        np.testing.assert_allclose(merged[col].astype(float), merged[col + "_index"].astype(float),
+                                   rtol=1e-12, atol=1e-14, err_msg=col)
+
+    stats = expected.dropna(subset=["user_id", "course_id"]).groupby(["user_id", "course_id"])[STAT_COLUMNS].first()
+    result_stats = index.student_stats()
+    pd.testing.assert_index_equal(result_stats.index, stats.index, exact=False)
+    np.testing.assert_allclose(result_stats.values, stats.values, rtol=1e-12, atol=1e-14)
+
+
+def merged_ranks(data):
+    # the merge of per student statistics add_ranks replaced; ranks over the rows with an assignment
+    # (grouped ranks of datetimes with missing keys rank NaT as the earliest time on pandas >= 2.0)
+    data = data.reset_index(drop=True)
+    by_assignment = data.dropna(subset=["assignment_id"]).groupby("assignment_id")["submitted_at"]
+    data["assignment_ranks"] = by_assignment.rank(method="average")
+    data["assignment_percentile_ranks"] = by_assignment.rank(method="average", pct=True)
+    by_student = data.groupby(["user_id", "course_id"])
+    stats = pd.concat({
+        "mean rank": by_student["assignment_ranks"].mean(),
+        "procrastination_mean_rank": by_student["assignment_percentile_ranks"].mean(),
+        "procrastination_median_rank": by_student["assignment_percentile_ranks"].median(),
+        "procrastination_var_rank": by_student["assignment_percentile_ranks"].var(),
+        "procrastination_std_rank": by_student["assignment_percentile_ranks"].std(),
+    }, axis=1)
+    return data.merge(stats.reset_index(), on=["user_id", "course_id"], how="left")
+
+
+def test_add_ranks_missing_keys(submissions, add_ranks):
+    data = submissions.assign(submitted_at=pd.to_datetime(submissions["submitted_at"]))
+    assert data[["user_id", "course_id"]].isna().any().all()
+    expected = merged_ranks(data)
+    result = add_ranks(data)
+    for col in ["assignment_ranks", "assignment_percentile_ranks"] + STAT_COLUMNS:
+        np.testing.assert_allclose(result[col].astype(float), expected[col], rtol=1e-12, atol=0, err_msg=col)
+    assert result.loc[data["user_id"].isna().values, STAT_COLUMNS].isna().all().all()
+
+
+@pytest.fixture
+def keyed(submissions):
+    data = submissions[KEY_COLUMNS + ["submitted_at"]].dropna(subset=KEY_COLUMNS)
+    data = data.assign(submitted_at=pd.to_datetime(data["submitted_at"])).reset_index(drop=True)
+    return data
+
+
+def test_updates_match_full_recompute(keyed, add_ranks):
+    rng = np.random.default_rng(0)
+    new = rng.random(len(keyed)) < 0.2
+    current = keyed[~new].reset_index(drop=True)
+    pending = keyed[new].reset_index(drop=True)
+    index = RankIndex(current)
+    assert_matches(index, add_ranks(current))
+
+    # a long stream of small batches, so error accumulating across updates would show up
+    n_batches = 120
+    for i, batch_rows in enumerate(np.array_split(np.arange(len(pending)), n_batches)):
+        # new submissions, and new times (some missing) for known ones
+        changed = current.sample(40, random_state=i).copy()
+        changed["submitted_at"] = changed["submitted_at"] + pd.to_timedelta(rng.integers(-72, 72, len(changed)), unit="h")
+        changed.iloc[:3, changed.columns.get_loc("submitted_at")] = pd.NaT
+        batch = pd.concat([changed, pending.iloc[batch_rows]], ignore_index=True)
+
+        updated = index.update(batch)
+        current = current.set_index(KEY_COLUMNS)
+        current.loc[changed.set_index(KEY_COLUMNS).index, "submitted_at"] = changed["submitted_at"].values
+        current = pd.concat([current.reset_index(), pending.iloc[batch_rows]], ignore_index=True)
+        if i % 30 == 29 or i == n_batches - 1:
+            assert_matches(index, add_ranks(current))
+        assert len(updated)
+
+
+def test_duplicate_keys_rejected(keyed):
+    index = RankIndex(keyed)
+    with pytest.raises(ValueError):
+        index.update(pd.concat([keyed.iloc[:1], keyed.iloc[:1]]))
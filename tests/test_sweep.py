@@ -0,0 +1,102 @@
+"""
+SubmissionSweep: worker frames share the memory-mapped base, parallel builds equal serial ones,
+configurations with the same fingerprint build the same data
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from clean import sweep
+from clean.instrument import Instrumentation
+
+CONFIGS = [(2, 5, 0.5, 0.5), (5, 10, 0.25, 0.75)]
+
+
+@pytest.fixture(scope="module")
+def base(submissions, submission_data):
+    obj = submission_data(submissions)
+    obj.base_clean()
+    data = obj.data.reset_index(drop=True)
+    data["submitted_utc"] = data["submitted_at"].dt.tz_localize("UTC")
+    return data
+
+
+def student_course_lvl(obj):
+    return obj.student_course_lvl
+
+
+def test_attached_frame_shares_memory(base, tmp_path, monkeypatch):
+    handle = sweep._share_frame(base, str(tmp_path))
+    maps = []
+    load = np.load
+
+    def tracked_load(*args, **kwargs):
+        maps.append(load(*args, **kwargs))
+        return maps[-1]
+
+    monkeypatch.setattr(sweep.np, "load", tracked_load)
+    attached, restore = sweep._attach_frame(handle)
+    worker = sweep.SubmissionSweep(list(base.columns), None, base=attached, instrument=Instrumentation(verbose=False))
+
+    assert len(maps) == len(base.columns)
+
+    def assert_shared():
+        for col, mapped in zip(base.columns, maps):
+            values = worker.base[col].array
+            buffer = values.codes if isinstance(values, pd.Categorical) else values.to_numpy()
+            assert np.shares_memory(buffer, mapped), col
+
+    assert_shared()
+    # filters take rows from base: pandas 1.x consolidated it in place (a private copy per worker)
+    worker.fingerprint(*CONFIGS[1])
+    worker.build(*CONFIGS[0])
+    assert_shared()
+    assert set(restore) == set(base.select_dtypes(exclude=["number", "datetime"]).columns)
+
+    restored = worker.base.copy()
+    sweep._restore_frame(restored, restore)
+    pd.testing.assert_frame_equal(restored, base)
+
+
+def test_parallel_map_matches_serial(base):
+    sweeper = sweep.SubmissionSweep(list(base.columns), None, base=base, instrument=Instrumentation(verbose=False))
+    serial = list(sweeper.map(student_course_lvl, CONFIGS, workers=1))
+    parallel = list(sweeper.map(student_course_lvl, CONFIGS, workers=2))
+    for expected, result in zip(serial, parallel):
+        pd.testing.assert_frame_equal(result, expected)
+
+
+def test_equal_fingerprints_build_same_data(base):
+    sweeper = sweep.SubmissionSweep(list(base.columns), None, base=base, instrument=Instrumentation(verbose=False))
+    same_data = {}
+    for config in itertools.product([2, 8, 11], [5, 20, 25], [0.25, 0.5], [0.5]):
+        same_data.setdefault(sweeper.fingerprint(*config), []).append(config)
+    assert 1 < len(same_data) < sum(len(group) for group in same_data.values())
+
+    built = {}
+    for fingerprint, group in same_data.items():
+        expected = sweeper.build(*group[0])
+        for config in group[1:]:
+            result = sweeper.build(*config)
+            pd.testing.assert_frame_equal(result.data, expected.data)
+            pd.testing.assert_frame_equal(result.student_course_lvl, expected.student_course_lvl)
+        built[fingerprint] = expected.data
+    # some configurations share a non-empty dataset, not only the empty one
+    assert any(len(group) > 1 and len(built[fingerprint]) for fingerprint, group in same_data.items())
+    assert all(not a.equals(b) for a, b in itertools.combinations(built.values(), 2))
+
+
+@pytest.mark.parametrize("col, change", [("final_score", 1.0), ("submitted_at", pd.Timedelta(hours=1))])
+def test_fingerprint_changes_with_values(base, col, change):
+    # a regrade or a new submission time keeps every key
+    config = CONFIGS[0]
+    sweeper = sweep.SubmissionSweep(list(base.columns), None, base=base, instrument=Instrumentation(verbose=False))
+    first = sweeper.build(*config).data.iloc[0]
+    changed = base.copy()
+    row = (changed[["course_id", "user_id", "assignment_id"]] == first[["course_id", "user_id", "assignment_id"]].values).all(axis=1)
+    assert row.sum() == 1
+    changed.loc[row, col] = changed.loc[row, col] + change
+    resweeper = sweep.SubmissionSweep(list(base.columns), None, base=changed, instrument=Instrumentation(verbose=False))
+    assert resweeper.fingerprint(*config) != sweeper.fingerprint(*config)